@@ -1 +1,18 @@
+import importlib
+
 from gym_graph_traffic.envs.graph_traffic import GraphTrafficEnv
+from gym_graph_traffic.envs.vector_graph_traffic import VectorGraphTrafficEnv
+
+# environments with heavier dependencies (asyncio server, multiprocessing.shared_memory) are imported on first access
+_LAZY_MODULES = {"EnvServer": "remote",
+                 "RemoteGraphTrafficEnv": "remote",
+                 "RemoteVectorGraphTrafficEnv": "remote",
+                 "SharedMemoryVectorGraphTrafficEnv": "shared_memory_vector_graph_traffic"}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_MODULES:
+        value = getattr(importlib.import_module(f"{__name__}.{_LAZY_MODULES[name]}"), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,42 @@
+import gym
+import numpy as np
+
+ACTION_MODES = ("discrete", "multi_discrete")
+
+
+class ActionDecoder:
+    """
+    Translates actions of the environment into action arrays: index of red duration for every intersection.
+
+    In "discrete" mode an action is a single int, whose digits in base num_red_durations are the indices
+    (see: README). In "multi_discrete" mode an action is already an array of indices, one per intersection.
+    """
+
+    def __init__(self, action_mode: str, num_red_durations: int, num_intersections: int):
+        if action_mode not in ACTION_MODES:
+            raise ValueError(f"Unknown action mode: {action_mode} (available: {', '.join(ACTION_MODES)})")
+
+        self.action_mode = action_mode
+        self.num_red_durations = num_red_durations
+        self.num_intersections = num_intersections
+
+        if action_mode == "discrete":
+            if num_red_durations ** num_intersections > np.iinfo(np.int64).max:
+                raise ValueError(f"{num_red_durations} ** {num_intersections} actions do not fit in a Discrete space, "
+                                 f"use multi_discrete action mode")
+            self.space = gym.spaces.Discrete(num_red_durations ** num_intersections)
+            # value of every digit: num_red_durations ** (num_intersections - 1), ..., num_red_durations ** 0
+            self.base = num_red_durations ** np.arange(num_intersections - 1, -1, -1, dtype=np.int64)
+        else:
+            self.space = gym.spaces.MultiDiscrete([num_red_durations] * num_intersections)
+            self.base = None
+
+    def decode(self, actions) -> np.ndarray:
+        """
+        :param actions: Single action or a batch of actions (along the first axis).
+        :return: Array of shape (..., num_intersections) with indices of red durations.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        if self.base is None:
+            return actions
+        return actions[..., None] // self.base % self.num_red_durations
@@ -0,0 +1,115 @@
+"""
+Open boundaries of a road network (see: OPEN_BOUNDARY in params.py).
+
+Layouts of util.grid close every row and column into a loop: segments wrapping around the network (see:
+RoadGraph.wrap_segments) lead from the last intersection of a row back to the first one. With open boundaries they
+are boundary segments instead:
+
+- sources - cars arrive at the beginning of every boundary segment from an arrival process (Poisson, with rates that
+  can change over the episode: a demand profile), they wait in a queue until the first cell of the segment is free,
+- sinks - cars that would enter a boundary segment leave the network (they pass the intersection as if the road
+  ahead was free).
+
+Arrivals of all sources (and copies of the network) are drawn together, in a single batch per step.
+"""
+import numpy as np
+
+from gym_graph_traffic.envs.road_graph import RoadGraph
+
+
+class OpenBoundary:
+    """
+    Sources and sinks of num_copies copies of a road network (segment i of copy c has index c * num_segments + i,
+    as in VectorizedEngine). Dynamic state (see: state_dtype):
+
+    - queue - cars waiting to enter every source,
+    - updates - updates since the beginning of the episode (time of the demand profile).
+    """
+
+    def __init__(self, graph: RoadGraph, params, num_copies: int, rng: np.random.Generator):
+        self.rng = rng
+        self.num_copies = num_copies
+
+        sources = params.get("boundary_segments")
+        if sources is None:
+            sources = graph.wrap_segments(params["intersections"])
+        self.sources = np.unique(np.asarray(sources, dtype=np.int64))
+        if self.sources.size == 0:
+            raise ValueError("Open boundary requires at least one boundary segment")
+        self.num_sources = self.sources.size
+
+        # source segments of all copies, and source -> segment of every copy of the network
+        copy_offset = np.arange(num_copies)[:, None] * graph.num_segments
+        self.source_segments = (copy_offset + self.sources).reshape(-1)
+        self.is_source = np.zeros(num_copies * graph.num_segments, dtype=bool)
+        self.is_source[self.source_segments] = True
+
+        # demand profile: arrival rates (cars per update) of every source, a row for every demand_period steps
+        # (repeated cyclically); a single rate or a rate of every source is a profile of one row
+        rates = np.asarray(params.get("arrival_rates", 0.1), dtype=np.float64)
+        profile = rates if rates.ndim == 2 else rates.reshape(1, -1)
+        self.arrival_rates = np.broadcast_to(profile, (len(profile), self.num_sources))
+        if np.any(self.arrival_rates < 0):
+            raise ValueError("Arrival rates must be non-negative")
+        self.updates_per_step = params["updates_per_step"]
+        self.period = params.get("demand_period", 1) * self.updates_per_step
+
+        # dynamic state
+        self.state_dtype = np.dtype([("queue", np.int64, (num_copies * self.num_sources,)),
+                                     ("updates", np.int64)])
+        self.bind(np.zeros((), dtype=self.state_dtype))
+
+        # arrivals of the updates until the end of the current step (drawn at once, see: arrivals)
+        self._arrivals = np.zeros((0, num_copies * self.num_sources), dtype=np.int64)
+        self._arrivals_start = 0
+
+    def bind(self, state: np.ndarray) -> None:
+        """
+        Keeps the state in given buffer of state_dtype (e.g. a field of the engine's state).
+        """
+        self.state = state
+        self.queue = state["queue"]
+
+    def get_state(self, state: np.ndarray) -> None:
+        state[...] = self.state
+
+    def set_state(self, state: np.ndarray) -> None:
+        self.state[...] = state
+        self._arrivals = self._arrivals[:0]
+
+    def reset(self, updates: int = 0) -> None:
+        """
+        Empties the queues.
+
+        :param updates: Updates since the beginning of the episode.
+        """
+        self.queue[:] = 0
+        self.state["updates"] = updates
+        self._arrivals = self._arrivals[:0]
+
+    def arrivals(self) -> np.ndarray:
+        """
+        :return: Cars arriving at every source (of every copy) during the current update. Arrivals of all updates
+                 until the end of the step are drawn at the first of them.
+        """
+        updates = int(self.state["updates"])
+        if not 0 <= updates - self._arrivals_start < len(self._arrivals):
+            times = updates + np.arange(self.updates_per_step - updates % self.updates_per_step)
+            rates = self.arrival_rates[times // self.period % len(self.arrival_rates)]
+            self._arrivals = self.rng.poisson(rates[:, None], (times.size, self.num_copies, self.num_sources)) \
+                .reshape(times.size, -1)
+            self._arrivals_start = updates
+        return self._arrivals[updates - self._arrivals_start]
+
+    def enter(self, free: np.ndarray) -> np.ndarray:
+        """
+        Adds arrivals of the update to the queues, and lets the first car of every queue enter its source.
+
+        :param free: True for every source (of every copy) whose first cell is free.
+        :return: True for every source a car entered.
+        """
+        self.queue += self.arrivals()
+        self.state["updates"] += 1
+        entering = free & (self.queue > 0)
+        self.queue -= entering
+        return entering
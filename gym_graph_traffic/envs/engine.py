@@ -0,0 +1,722 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+
+from gym_graph_traffic.envs import kernels
+from gym_graph_traffic.envs.boundary import OpenBoundary
+from gym_graph_traffic.envs.intersection import Intersection
+from gym_graph_traffic.envs.road_graph import PHASE_CODES, PHASE_GREEN, RoadGraph, index_dtype
+from gym_graph_traffic.envs.routes import CarRoutes, make_routes
+from gym_graph_traffic.envs.segment import Segment
+
+
+class SegmentEngine:
+    """
+    Reference engine: every Segment runs its own cellular automaton, cars that crossed intersections are then
+    gathered from all segments at once and handed over to their destinations (see: exchange).
+    """
+
+    requires_segments = True
+    # run() steps one update at a time (see: VectorizedEngine.fuses_run)
+    fuses_run = False
+
+    def __init__(self, graph: RoadGraph, segments: List[Segment], intersections: List[Intersection], params,
+                 rng: np.random.Generator):
+        self.graph = graph
+        self.segments = segments
+        self.intersections = intersections
+        self.num_copies = 1
+        self.rng = rng
+
+        self.num_segments = graph.num_segments
+        self.max_v = params["max_v"]
+        self.prob_slow_down = params["prob_slow_down"]
+        self.lengths = graph.lengths
+
+        # free init cells of every segment after last update (gathered from the segments)
+        self.free_init_cells = np.array([s.free_init_cells for s in segments], dtype=np.int64)
+
+        # metrics of every segment after last update, written by the segments themselves
+        metrics = np.zeros((2, 1, self.num_segments), dtype=np.int64)
+        for s in segments:
+            metrics[:, 0, s.idx] = s.metrics
+            s.metrics = metrics[:, 0, s.idx]
+        self.total_distance = metrics[0]
+        self.num_cars = metrics[1]
+
+        # number of cars that left every segment during last update
+        self.crossed = np.zeros((1, self.num_segments), dtype=np.int64)
+
+        # following segment of every segment: straight through, or chosen by the route of its first car (see: routes)
+        self.next_segment = graph.next_segment
+        self.has_next_segment = graph.has_next_segment
+        routes = make_routes(graph, params)
+        self.routes = None
+        if routes is not None:
+            self.routes = CarRoutes(graph, routes, 1, rng)
+            self.routes.reset(self.occupancy()[0])
+            self.next_segment = np.zeros(self.num_segments, dtype=np.int64)
+            self.has_next_segment = np.zeros(self.num_segments, dtype=bool)
+
+        # open boundary: sources cars arrive at and segments whose cars leave the network (see: boundary)
+        self.boundary = OpenBoundary(graph, params, 1, rng) if params.get("open_boundary", False) else None
+        self._sink = np.zeros(self.num_segments, dtype=bool)
+        self._entering_position = np.zeros(1, dtype=np.int64)
+        self._entering_velocity = np.zeros(1, dtype=np.int8)
+
+        # cars crossing intersections during an update (destination segment, position in it and velocity),
+        # a segment can pass at most max_v cars (it is extended by at most max_v free cells of the following one)
+        capacity = self.num_segments * self.max_v
+        self._crossing_segment = np.zeros(capacity, dtype=np.int64)
+        self._crossing_position = np.zeros(capacity, dtype=np.int64)
+        self._crossing_velocity = np.zeros(capacity, dtype=np.int8)
+
+        # index of the first car of every segment (and the total number of cars) in the slow down draws of an update
+        self._first_car = np.zeros(self.num_segments + 1, dtype=np.int64)
+
+        # dynamic state (see: get_state)
+        num_cells = graph.num_cells
+        self.state_dtype = np.dtype([("p", np.int8, (1, num_cells)),
+                                     ("v", np.int8, (1, num_cells)),
+                                     *([("routes", self.routes.state_dtype)] if self.routes is not None else []),
+                                     *([("boundary", self.boundary.state_dtype)] if self.boundary is not None else [])],
+                                    align=True)
+
+    def reset(self) -> None:
+        for s in self.segments:
+            s.reset()
+        self.free_init_cells[:] = [s.free_init_cells for s in self.segments]
+        if self.routes is not None:
+            self.routes.reset(self.occupancy()[0])
+        if self.boundary is not None:
+            self.boundary.reset()
+
+    def set_traffic(self, car_density: float, prob_slow_down: float) -> None:
+        """
+        Changes traffic parameters (e.g. of a reused environment), the new density applies from the next reset.
+        """
+        self.prob_slow_down = prob_slow_down
+        for s in self.segments:
+            s.car_density = car_density
+            s.prob_slow_down = prob_slow_down
+
+    def occupancy(self) -> np.ndarray:
+        """
+        :return: Array of shape (1, num_cells): 1 for every cell occupied by a car, 0 otherwise.
+        """
+        return np.concatenate([s.p for s in self.segments]).astype(np.int8)[None]
+
+    def velocity(self) -> np.ndarray:
+        """
+        :return: Array of shape (1, num_cells): velocity of the car occupying every cell, 0 for free cells.
+        """
+        velocity = np.zeros((1, self.graph.num_cells), dtype=np.int8)
+        velocity[0, np.flatnonzero(self.occupancy()[0])] = np.concatenate([s.v for s in self.segments])
+        return velocity
+
+    def load_cells(self, occupancy: np.ndarray, velocity: np.ndarray) -> None:
+        """
+        Sets positions and velocities of all cars (with new routes).
+
+        :param occupancy: Array of shape (num_cells,), see: occupancy().
+        :param velocity: Array of shape (num_cells,), see: velocity().
+        """
+        occupancy = np.reshape(occupancy, -1)
+        velocity = np.reshape(velocity, -1)
+        for s, start, end in zip(self.segments, self.graph.offsets, self.graph.ends):
+            s.set_cells(occupancy[start:end], velocity[start:end])
+        self.free_init_cells[:] = [s.free_init_cells for s in self.segments]
+        if self.routes is not None:
+            self.routes.reset(occupancy)
+
+    def get_state(self, state: np.ndarray) -> None:
+        """
+        Writes dynamic state of the engine into state (of state_dtype).
+        """
+        state["p"] = self.occupancy()
+        state["v"] = self.velocity()
+        if self.routes is not None:
+            self.routes.get_state(state["routes"])
+        if self.boundary is not None:
+            self.boundary.get_state(state["boundary"])
+
+    def set_state(self, state: np.ndarray) -> None:
+        """
+        Restores dynamic state of the engine written by get_state.
+        """
+        self.load_cells(state["p"], state["v"])
+        if self.routes is not None:
+            self.routes.set_state(state["routes"])
+        if self.boundary is not None:
+            self.boundary.set_state(state["boundary"])
+
+    def update(self, phase: np.ndarray = None) -> None:
+        self.update_first_phase(phase)
+        self.update_second_phase()
+
+    def run(self, phases: np.ndarray, reward_observation) -> None:
+        """
+        Same as update(phase) followed by reward_observation.update() for every phase.
+        """
+        for phase in phases:
+            self.update(phase)
+            reward_observation.update()
+
+    def extension(self, phase: np.ndarray) -> np.ndarray:
+        """
+        :return: Free cells of the following segment every segment is extended by (0 if it has red light).
+        """
+        green = PHASE_GREEN[phase[self.graph.to_intersection], self.graph.to_side] & self.has_next_segment
+        if self.boundary is not None:
+            sink = green & self._sink
+            green &= ~self._sink
+        if self.routes is not None:
+            green = self.routes.right_of_way(green, self.next_segment)
+        extension = np.where(green, self.free_init_cells[self.next_segment], 0)
+        if self.boundary is not None:
+            # cars leaving the network see free road ahead
+            extension[sink] = self.max_v
+        return extension
+
+    def update_first_phase(self, phase: np.ndarray = None) -> int:
+        """
+        First phase of the update: cellular automata step of every segment, followed by the exchange of cars that
+        crossed intersections.
+
+        :return: Number of cars that crossed intersections.
+        """
+        if phase is None:
+            phase = np.array([PHASE_CODES[i.state] for i in self.intersections], dtype=np.int64)
+        if self.routes is not None:
+            self.routes.next_segment(self.next_segment)
+            np.greater_equal(self.next_segment, 0, out=self.has_next_segment)
+        if self.boundary is not None:
+            np.logical_and(self.boundary.is_source[self.next_segment], self.has_next_segment, out=self._sink)
+        extension = self.extension(phase)
+
+        # single random draw for the whole network, every segment gets a view of the draws of its cars
+        np.cumsum(self.num_cars[0], out=self._first_car[1:])
+        slow_down = self.rng.binomial(1, self.prob_slow_down, self._first_car[-1])
+        crossing = [s for s, first, last, segment_extension in zip(
+                    self.segments, self._first_car[:-1], self._first_car[1:], extension)
+                    if s.update_first_phase(slow_down[first:last], segment_extension)]
+        num_crossing = self.exchange(crossing)
+        if self.boundary is not None:
+            self.enter_boundary()
+        return num_crossing
+
+    def exchange(self, crossing: List[Segment]) -> int:
+        """
+        Moves cars that crossed intersections to the following segments: all of them are gathered into arrays and
+        sorted by destination segment and position (batched), then every destination receives its cars in a single
+        receive_cars call (a Python loop over destination segments, as cars live in buffers of the segments).
+        A segment can receive several cars in a single update.
+
+        :param crossing: Segments with cars past their end (see: Segment.update_first_phase).
+        :return: Number of cars that crossed intersections (cars that left the network included).
+        """
+        num_crossing = 0
+        self.crossed[:] = 0
+        destination = self.next_segment if self.boundary is None else np.where(self._sink, -1, self.next_segment)
+        for s in crossing:
+            n = s.pop_crossing_cars(self._crossing_position[num_crossing:], self._crossing_velocity[num_crossing:])
+            self._crossing_segment[num_crossing:num_crossing + n] = destination[s.idx]
+            self.crossed[0, s.idx] = n
+            num_crossing += n
+        if num_crossing == 0:
+            return 0
+
+        segment = self._crossing_segment[:num_crossing]
+        if self.routes is not None:
+            landing_cell = self.graph.offsets[segment] + self._crossing_position[:num_crossing]
+            self.routes.exchange(np.flatnonzero(self.crossed[0]), np.where(segment >= 0, landing_cell, -1))
+        # cars that left the network (destination -1) are sorted first and dropped
+        order = np.lexsort((self._crossing_position[:num_crossing], segment))[np.count_nonzero(segment < 0):]
+        segment = segment[order]
+        position = self._crossing_position[order]
+        velocity = self._crossing_velocity[order]
+        if segment.size == 0:
+            return num_crossing
+        bounds = np.flatnonzero(segment[1:] != segment[:-1]) + 1
+        for start, end in zip([0, *bounds.tolist()], [*bounds.tolist(), segment.size]):
+            self.segments[segment[start]].receive_cars(position[start:end], velocity[start:end])
+        return num_crossing
+
+    def enter_boundary(self) -> None:
+        """
+        First cars of the queues of open boundary sources enter the first cells of their segments (if they are free).
+        """
+        sources = self.boundary.sources
+        free = np.array([self.segments[s].p[0] == 0 for s in sources.tolist()])
+        entering = sources[self.boundary.enter(free)]
+        for s in entering.tolist():
+            self.segments[s].receive_cars(self._entering_position, self._entering_velocity)
+        if self.routes is not None:
+            self.routes.enter(self.graph.offsets[entering])
+
+    def update_second_phase(self) -> None:
+        for s in self.segments:
+            s.update_second_phase()
+        self.free_init_cells[:] = [s.free_init_cells for s in self.segments]
+
+    def buffers(self) -> List[np.ndarray]:
+        """
+        :return: Arrays holding cars of all segments (see: profiling, reallocations).
+        """
+        return [a for s in self.segments for a in s.buffers()]
+
+    def close(self) -> None:
+        pass
+
+
+class VectorizedEngine:
+    """
+    Whole-network engine: cells and velocities of all segments are kept in two flat, preallocated arrays
+    (segment i occupies cells offsets[i]:offsets[i] + lengths[i]), so a single update of the Nagel-Schreckenberg
+    automaton is a handful of NumPy operations regardless of the number of segments.
+
+    Several independent copies of the same road network can be simulated at once (num_copies): they are laid out
+    one after another in the flat arrays, so the cost of an update is shared by all of them.
+
+    It follows the rules of SegmentEngine exactly: under the same seed both engines produce identical trajectories.
+    The automaton step runs either as NumPy array operations or as a compiled numba kernel (see: kernels),
+    both give the same results.
+
+    With the numba backend, a large network can be cut into spatial partitions (params "partitions", see:
+    RoadGraph.spatial_partitions) stepped in parallel threads: kernels release the GIL, cars crossing intersections
+    are collected by every partition and placed in their segments once all partitions moved (halo exchange), and
+    random draws keep the order of the whole network, so results are identical to a single thread.
+    """
+
+    requires_segments = False
+
+    def __init__(self, graph: RoadGraph, segments: List[Segment], intersections: List[Intersection], params,
+                 rng: np.random.Generator, num_copies: int = 1):
+        """
+        :param segments: If given (non-empty), every copy starts from the state the segments were initialized with
+                         (and the segments share position vectors with the first copy, for rendering).
+                         Otherwise initial state is drawn as in reset().
+        :param intersections: Traffic lights are read from them, unless phases are given to update().
+        """
+        self.graph = graph
+        self.segments = segments
+        self.intersections = intersections
+        self.num_copies = num_copies
+        self.rng = rng
+
+        # kernels
+        self.kernel_backend = kernels.resolve_kernel_backend(params.get("kernel_backend", "auto"))
+        if self.kernel_backend == "numba":
+            self._nagel_schreckenberg_step = self._nagel_schreckenberg_step_numba
+            self._update_free_init_cells = self._update_free_init_cells_numba
+
+        # cellular automata parameters
+        self.num_segments = graph.num_segments
+        self.num_intersections = graph.num_intersections
+        self.max_v = params["max_v"]
+        self.car_density = params["car_density"]
+        self.prob_slow_down = params["prob_slow_down"]
+
+        # graph info (of a single copy)
+        self.lengths = graph.lengths
+        self.num_cells = graph.num_cells
+
+        # graph info of all copies (segment i of copy c has index c * num_segments + i)
+        copy_of_segment = np.repeat(np.arange(num_copies), self.num_segments)
+        all_lengths = np.tile(self.lengths, num_copies)
+        self.ends = np.cumsum(all_lengths)
+        self.offsets = self.ends - all_lengths
+        num_copy_segments = num_copies * self.num_segments
+        self.segment_of_cell = np.repeat(np.arange(num_copy_segments, dtype=index_dtype(num_copy_segments)),
+                                         all_lengths)
+        self.to_intersection = np.tile(graph.to_intersection, num_copies) + copy_of_segment * self.num_intersections
+        self.to_side = np.tile(graph.to_side, num_copies)
+        next_segment = np.where(graph.has_next_segment, graph.next_segment, 0)
+        self.next_segment = np.tile(next_segment, num_copies) + copy_of_segment * self.num_segments
+        self.has_next_segment = np.tile(graph.has_next_segment, num_copies)
+        self.all_lengths = all_lengths
+        self.next_offsets = self.offsets[self.next_segment]
+
+        # turning movements / origin-destination routes: following segments are chosen by the routes of the first
+        # cars of segments before every update (see: routes)
+        routes = make_routes(graph, params)
+        self.routes = CarRoutes(graph, routes, num_copies, rng) if routes is not None else None
+        self._route_next_segment = np.zeros(num_copies * self.num_segments, dtype=np.int64)
+
+        # open boundary: sources cars arrive at and segments whose cars leave the network, cars leaving the network
+        # land in negative cells, which are not placed (see: boundary, kernels.place_cars)
+        self.boundary = OpenBoundary(graph, params, num_copies, rng) if params.get("open_boundary", False) else None
+        self._sink = np.zeros(num_copies * self.num_segments, dtype=bool)
+        self._source_cells = self.offsets[self.boundary.source_segments] if self.boundary is not None else None
+
+        # first max_v cells of every segment (the ones that can be entered from the preceding segment)
+        init_cells = np.arange(self.max_v)
+        self.init_cells_valid = init_cells < all_lengths[:, None]
+        self.init_cells = np.where(self.init_cells_valid, self.offsets[:, None] + init_cells, 0)
+
+        # dynamic state: all arrays below are views of a single buffer, so it is saved/restored by one copy
+        num_copy_segments = num_copies * self.num_segments
+        self.state_dtype = np.dtype([("p", np.int8, (num_copies, self.num_cells)),
+                                     ("v", np.int8, (num_copies, self.num_cells)),
+                                     ("free_init_cells", np.int64, (num_copy_segments,)),
+                                     ("total_distance", np.int64, (num_copies, self.num_segments)),
+                                     ("num_cars", np.int64, (num_copies, self.num_segments)),
+                                     *([("routes", self.routes.state_dtype)] if self.routes is not None else []),
+                                     *([("boundary", self.boundary.state_dtype)] if self.boundary is not None else [])],
+                                    align=True)
+        self.state = np.zeros((), dtype=self.state_dtype)
+        if self.routes is not None:
+            self.routes.bind(self.state["routes"])
+        if self.boundary is not None:
+            self.boundary.bind(self.state["boundary"])
+
+        # cars positions and velocities, p_flat and v_flat are views of all copies one after another
+        self.p = self.state["p"]  # 1 if there is a car, 0 otherwise
+        self.v = self.state["v"]  # velocity of the car occupying the cell
+        self.p_flat = self.p.reshape(-1)
+        self.v_flat = self.v.reshape(-1)
+        self.free_init_cells = self.state["free_init_cells"]
+
+        # extension of every segment and cars crossing intersections during an update (numba kernels)
+        self._extension = np.zeros(num_copy_segments, dtype=np.int64)
+        self._pending_cell = np.zeros(num_copy_segments, dtype=np.int64)
+        self._pending_v = np.zeros(num_copy_segments, dtype=np.int64)
+
+        # spatial partitions stepped in parallel (the calling thread processes the first one)
+        self.num_partitions = params.get("partitions", 1)
+        self.partitions = None
+        if self.num_partitions > 1:
+            if self.kernel_backend != "numba":
+                raise ValueError("Partitioned stepping requires the numba kernel backend")
+            partition = np.tile(graph.spatial_partitions(params["intersections"], self.num_partitions), num_copies)
+            self.partitions = [np.flatnonzero(partition == i) for i in range(self.num_partitions)]
+            self._partition_pending = [(np.zeros(segments.size, dtype=np.int64),
+                                        np.zeros(segments.size, dtype=np.int64)) for segments in self.partitions]
+            self._first_car_rank = np.zeros(num_copy_segments, dtype=np.int64)
+            self._executor = ThreadPoolExecutor(self.num_partitions - 1)
+            self._nagel_schreckenberg_step = self._nagel_schreckenberg_step_partitioned
+            self._update_free_init_cells = self._update_free_init_cells_partitioned
+            self._update_metrics = self._update_metrics_partitioned
+
+        # metrics of every segment after last update: total distance covered by cars and number of cars
+        self.total_distance = self.state["total_distance"]
+        self.num_cars = self.state["num_cars"]
+
+        # number of cars that left every segment during last update
+        self.crossed = np.zeros((num_copies, self.num_segments), dtype=np.int64)
+        self.crossed_flat = self.crossed.reshape(-1)
+
+        if not segments:
+            self.reset()
+        else:
+            for s, offset in zip(segments, self.offsets):
+                self.p[:, offset:offset + s.length] = s.p
+                self.v[:, offset + s.p.nonzero()[0]] = s.v
+                s.p = self.p[0, offset:offset + s.length]
+            self._update_free_init_cells()
+            self._update_metrics()
+            if self.routes is not None:
+                self.routes.reset(self.p_flat)
+
+    def reset(self) -> None:
+        self.p[:] = self.rng.binomial(1, self.car_density, self.p.shape)
+        self.v[:] = 0
+        self._update_free_init_cells()
+        self._update_metrics()
+        if self.routes is not None:
+            self.routes.reset(self.p_flat)
+        if self.boundary is not None:
+            self.boundary.reset()
+
+    def set_traffic(self, car_density: float, prob_slow_down: float) -> None:
+        """
+        Changes traffic parameters (e.g. of a reused environment), the new density applies from the next reset.
+        """
+        self.car_density = car_density
+        self.prob_slow_down = prob_slow_down
+
+    def occupancy(self) -> np.ndarray:
+        """
+        :return: Array of shape (num_copies, num_cells): 1 for every cell occupied by a car, 0 otherwise.
+        """
+        return self.p
+
+    def velocity(self) -> np.ndarray:
+        """
+        :return: Array of shape (num_copies, num_cells): velocity of the car occupying every cell, 0 for free cells.
+        """
+        return self.v
+
+    def load_cells(self, occupancy: np.ndarray, velocity: np.ndarray) -> None:
+        """
+        Sets positions and velocities of all cars (with new routes).
+
+        :param occupancy: Array of shape (num_cells,) (the same for every copy) or (num_copies, num_cells).
+        :param velocity: Array of the same shape, velocity of the car occupying every cell.
+        """
+        self.p[:] = occupancy
+        self.v[:] = np.where(self.p == 1, velocity, 0)
+        self._update_free_init_cells()
+        self._update_metrics()
+        if self.routes is not None:
+            self.routes.reset(self.p_flat)
+
+    def get_state(self, state: np.ndarray) -> None:
+        """
+        Writes dynamic state of the engine into state (of state_dtype).
+        """
+        state[...] = self.state
+
+    def set_state(self, state: np.ndarray) -> None:
+        """
+        Restores dynamic state of the engine written by get_state.
+        """
+        self.state[...] = state
+        if self.boundary is not None:
+            self.boundary.set_state(state["boundary"])
+
+    def update(self, phase: np.ndarray = None) -> None:
+        """
+        Single update of the whole network: cellular automata step of every segment, including cars that
+        cross intersections.
+
+        :param phase: Array of shape (num_copies, num_intersections) with traffic light phase codes
+                      (see: road_graph.PHASES). Read from the intersections if not given.
+        """
+        self.update_first_phase(phase)
+        self.update_second_phase()
+
+    @property
+    def fuses_run(self) -> bool:
+        """
+        True if run() fuses all updates into a single compiled loop: numba backend, a single partition, no routes
+        (the number of cars is constant) and no open boundary.
+        """
+        return self.kernel_backend == "numba" and self.partitions is None and self.routes is None \
+            and self.boundary is None
+
+    def run(self, phases: np.ndarray, reward_observation) -> None:
+        """
+        Same as update(phase) followed by reward_observation.update() for every phase. With the numba backend all
+        updates (reward and observation accumulation included) are fused into a single compiled loop.
+
+        :param phases: Array of shape (num_updates, num_copies, num_intersections) with traffic light phase codes.
+        """
+        if not self.fuses_run:
+            for phase in phases:
+                self.update(phase)
+                reward_observation.update()
+            return
+
+        # number of cars does not change, so random slow downs of all updates are drawn at once
+        num_updates = len(phases)
+        slow_down = self.rng.binomial(1, self.prob_slow_down, num_updates * int(np.sum(self.num_cars)))
+        kernels.run_updates(self.p_flat, self.v_flat, self.offsets, self.ends, self.next_offsets, self.next_segment,
+                            self.has_next_segment, self.to_intersection, self.to_side, PHASE_GREEN,
+                            np.reshape(phases, (num_updates, -1)), self.all_lengths, self.max_v, self.num_segments,
+                            slow_down, self.free_init_cells, self.total_distance.reshape(-1),
+                            self.num_cars.reshape(-1), self._extension, self._pending_cell, self._pending_v,
+                            self.crossed_flat, reward_observation.reward, reward_observation.observation)
+        reward_observation.num_steps += num_updates
+
+    def extension(self, phase: np.ndarray) -> np.ndarray:
+        """
+        :return: Free cells of the following segment every segment is extended by (0 if it has red light).
+        """
+        green = PHASE_GREEN[phase.reshape(-1)[self.to_intersection], self.to_side] & self.has_next_segment
+        if self.boundary is not None:
+            sink = green & self._sink
+            green &= ~self._sink
+        if self.routes is not None:
+            green = self.routes.right_of_way(green, self.next_segment)
+        extension = np.where(green, self.free_init_cells[self.next_segment], 0)
+        if self.boundary is not None:
+            # cars leaving the network see free road ahead
+            extension[sink] = self.max_v
+        return extension
+
+    def update_first_phase(self, phase: np.ndarray = None) -> int:
+        """
+        First phase of the update: cellular automata step of all segments (cars crossing intersections included).
+
+        :return: Number of cars that crossed intersections.
+        """
+        if phase is None:
+            phase = np.array([PHASE_CODES[i.state] for i in self.intersections], dtype=np.int64)
+        if self.routes is None and self.boundary is None:
+            return self._nagel_schreckenberg_step(self.extension(phase))
+
+        if self.routes is not None:
+            self.routes.next_segment(self._route_next_segment)
+            np.greater_equal(self._route_next_segment, 0, out=self.has_next_segment)
+            np.maximum(self._route_next_segment, 0, out=self.next_segment)
+            np.take(self.offsets, self.next_segment, out=self.next_offsets)
+        if self.boundary is not None:
+            np.logical_and(self.boundary.is_source[self.next_segment], self.has_next_segment, out=self._sink)
+            np.copyto(self.next_offsets, -self.max_v, where=self._sink)
+        num_crossing = self._nagel_schreckenberg_step(self.extension(phase))
+        if self.routes is not None:
+            self.routes.exchange(*self._crossing_cars(num_crossing))
+        if self.boundary is not None:
+            self.enter_boundary()
+        return num_crossing
+
+    def _crossing_cars(self, num_crossing: int):
+        """
+        :return: Segments the cars that crossed intersections during the last update left (in increasing order),
+                 and cells they entered.
+        """
+        if self.partitions is None:
+            return np.flatnonzero(self.crossed_flat), self._pending_cell[:num_crossing]
+        source = np.concatenate([segments[self.crossed_flat[segments] > 0] for segments in self.partitions])
+        landing_cell = np.concatenate([pending_cell[:n] for (pending_cell, _), n in
+                                       zip(self._partition_pending, self._partition_num_pending)])
+        order = np.argsort(source)
+        return source[order], landing_cell[order]
+
+    def enter_boundary(self) -> None:
+        """
+        First cars of the queues of open boundary sources enter the first cells of their segments (if they are free).
+        """
+        entering = self._source_cells[self.boundary.enter(self.p_flat[self._source_cells] == 0)]
+        self.p_flat[entering] = 1
+        if self.routes is not None:
+            self.routes.enter(entering)
+
+    def update_second_phase(self) -> None:
+        """
+        Second phase of the update: updating information about init cells and metrics of all segments.
+        """
+        self._update_free_init_cells()
+        self._update_metrics()
+
+    def _nagel_schreckenberg_step_numpy(self, extension: np.ndarray) -> int:
+        """
+        Updating automata of all segments by the rules of Nagel-Schreckenberg model.
+
+        :param extension: Number of cells of the following segment every segment is extended by.
+        :return: Number of cars that crossed intersections.
+        """
+        cars = np.flatnonzero(self.p_flat)
+        car_segment = self.segment_of_cell[cars]
+        v = self.v_flat[cars].astype(np.int64)
+
+        # 1. Acceleration
+        v += 1
+        np.minimum(v, self.max_v, out=v)
+
+        # 2. Slowing down (the last car of a segment sees the end of the segment plus the extension)
+        free_cells = np.empty_like(cars)
+        free_cells[:-1] = cars[1:] - cars[:-1] - 1
+        last = np.ones(cars.size, dtype=bool)
+        last[:-1] = car_segment[1:] != car_segment[:-1]
+        last_segment = car_segment[last]
+        free_cells[last] = self.ends[last_segment] - cars[last] - 1 + extension[last_segment]
+        np.minimum(v, free_cells, out=v)
+
+        # 3. Randomization
+        v -= self.rng.binomial(1, self.prob_slow_down, v.size)
+        np.maximum(v, 0, out=v)
+
+        # 4. Car motion (cars that moved past the end of a segment land in the following one)
+        new_cars = cars + v
+        crossing = new_cars >= self.ends[car_segment]
+        crossing_segment = car_segment[crossing]
+        new_cars[crossing] += self.next_offsets[crossing_segment] - self.ends[crossing_segment]
+
+        self.crossed_flat[:] = np.bincount(crossing_segment, minlength=self.crossed_flat.size)
+        self._pending_cell[:crossing_segment.size] = new_cars[crossing]
+        if self.boundary is not None:
+            # cars that left the network (see: boundary)
+            staying = new_cars >= 0
+            new_cars = new_cars[staying]
+            v = v[staying]
+
+        self.p_flat[cars] = 0
+        self.v_flat[cars] = 0
+        self.p_flat[new_cars] = 1
+        self.v_flat[new_cars] = v
+        return crossing_segment.size
+
+    def _nagel_schreckenberg_step_numba(self, extension: np.ndarray) -> int:
+        slow_down = self.rng.binomial(1, self.prob_slow_down, int(np.sum(self.num_cars)))
+        return kernels.nagel_schreckenberg_step(self.p_flat, self.v_flat, self.offsets, self.ends, self.next_offsets,
+                                         extension, self.num_cars.reshape(-1), slow_down, self.max_v,
+                                         self._pending_cell, self._pending_v, self.crossed_flat)
+
+    _nagel_schreckenberg_step = _nagel_schreckenberg_step_numpy
+
+    def _update_free_init_cells_numpy(self) -> None:
+        """
+        Updating information about init cells of all segments.
+        """
+        occupied = (self.p_flat[self.init_cells] == 1) | ~self.init_cells_valid
+        self.free_init_cells[:] = np.where(occupied.any(axis=1), occupied.argmax(axis=1), self.max_v)
+
+    def _update_free_init_cells_numba(self) -> None:
+        kernels.free_init_cells(self.p_flat, self.offsets, self.all_lengths, self.max_v, self.free_init_cells)
+
+    _update_free_init_cells = _update_free_init_cells_numpy
+
+    def _for_partitions(self, function) -> list:
+        """
+        :return: Results of function(i) for every partition i, computed in parallel threads.
+        """
+        futures = [self._executor.submit(function, i) for i in range(1, self.num_partitions)]
+        return [function(0)] + [future.result() for future in futures]
+
+    def _nagel_schreckenberg_step_partitioned(self, extension: np.ndarray) -> int:
+        num_cars = self.num_cars.reshape(-1)
+        slow_down = self.rng.binomial(1, self.prob_slow_down, int(np.sum(num_cars)))
+        np.cumsum(num_cars[:-1], out=self._first_car_rank[1:])
+
+        def step(i):
+            pending_cell, pending_v = self._partition_pending[i]
+            return kernels.nagel_schreckenberg_step_partition(
+                self.p_flat, self.v_flat, self.partitions[i], self.offsets, self.ends, self.next_offsets, extension,
+                num_cars, self._first_car_rank, slow_down, self.max_v, pending_cell, pending_v, self.crossed_flat)
+
+        num_pending = self._for_partitions(step)
+        self._partition_num_pending = num_pending
+
+        # halo exchange: cars that crossed intersections (borders of partitions included) enter the following
+        # segments only after all partitions moved their cars
+        for (pending_cell, pending_v), n in zip(self._partition_pending, num_pending):
+            kernels.place_cars(self.p_flat, self.v_flat, pending_cell, pending_v, n)
+        return sum(num_pending)
+
+    def _update_free_init_cells_partitioned(self) -> None:
+        self._for_partitions(lambda i: kernels.free_init_cells_partition(
+            self.p_flat, self.partitions[i], self.offsets, self.all_lengths, self.max_v, self.free_init_cells))
+
+    def _update_metrics_partitioned(self) -> None:
+        self._for_partitions(lambda i: kernels.segment_metrics_partition(
+            self.p_flat, self.v_flat, self.partitions[i], self.offsets, self.ends, self.total_distance.reshape(-1),
+            self.num_cars.reshape(-1)))
+
+    def _update_metrics(self) -> None:
+        """
+        Updating metrics of all segments (in place): total distance and number of cars.
+        """
+        np.add.reduceat(self.v_flat, self.offsets, dtype=np.int64, out=self.total_distance.reshape(-1))
+        np.add.reduceat(self.p_flat, self.offsets, dtype=np.int64, out=self.num_cars.reshape(-1))
+
+    def buffers(self) -> List[np.ndarray]:
+        """
+        :return: Arrays holding cars of all copies (see: profiling, reallocations).
+        """
+        return [self.p, self.v]
+
+    def close(self) -> None:
+        """
+        Stops worker threads of partitioned stepping.
+        """
+        if self.partitions is not None:
+            self._executor.shutdown()
+
+
+ENGINES = {
+    "segments": SegmentEngine,
+    "vectorized": VectorizedEngine,
+}
@@ -1,15 +1,24 @@
-from typing import List
+from typing import List, Tuple
 
 import gym
 import numpy as np
-import pygame
 from attrdict import AttrDict
 
+from gym_graph_traffic.envs.actions import ActionDecoder
+from gym_graph_traffic.envs.engine import ENGINES
 from gym_graph_traffic.envs.intersection import FourWayNoTurnsIntersection
+from gym_graph_traffic.envs.profiling import Profiler
+from gym_graph_traffic.envs.rendering import FrameRecorder, FrameRenderer
+from gym_graph_traffic.envs.road_graph import RoadGraph
 from gym_graph_traffic.envs.segment import Segment
+from gym_graph_traffic.envs.signals import SignalController, red_duration_plans
+from gym_graph_traffic.envs.telemetry import Telemetry
+from gym_graph_traffic.envs.trajectory import TrajectoryRecorder
 
 
 class GraphTrafficEnv(gym.Env):
+    metadata = {"render.modes": ["human", "rgb_array"]}
+
     def __init__(self, params):
 
         params = AttrDict(params)
@@ -18,24 +27,78 @@ class GraphTrafficEnv(gym.Env):
         # simulation params
         self.updates_per_step = params.updates_per_step
         self.steps_per_episode = params.steps_per_episode
+        self.fast_forward = params.get("fast_forward", False)
         self.red_durations = params.red_durations
         self.red_durations_raw = params.red_durations_raw
         self.num_red_durations = len(params.red_durations)
 
+        # incompatible parameters are rejected before any engine thread, output file or window is created
+        render_mode = params.get("render_mode", "human")
+        if render_mode not in self.metadata["render.modes"]:
+            raise ValueError(f"Unknown render mode: {render_mode} "
+                             f"(available: {', '.join(self.metadata['render.modes'])})")
+        if self.fast_forward and (params.render or params.get("record_trajectory") or params.get("telemetry")):
+            raise ValueError("Fast forward skips intermediate updates, it cannot be used with rendering, "
+                             "trajectory recording or telemetry")
+
+        # random number generator of the whole environment (segments, engine)
+        self.np_random = np.random.default_rng(params.get("seed"))
+
         # road graph
         self.num_intersections = len(params.intersections)
         self.num_segments = len(params.segments)
-        self.intersections = []
-        self.segments = []
-        self._set_up_road_graph(params)
+        self.road_graph = RoadGraph.from_params(params)
+
+        # traffic lights of all intersections, actions select their plans (see: signals.SignalController)
+        self.signals = SignalController(red_duration_plans(self.red_durations), self.num_intersections)
+        self._phases = np.zeros((self.updates_per_step, self.num_intersections), dtype=np.int64)
+
+        self.intersections: List[FourWayNoTurnsIntersection] = []
+        self.segments: List[Segment] = []
+
+        # simulation engine
+        engine = params.get("engine", "segments")
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine} (available: {', '.join(ENGINES)})")
+        if ENGINES[engine].requires_segments or (params.render and params.get("render_mode", "human") == "human"):
+            self._set_up_road_graph(params)
+        else:
+            # the engine keeps all cars in its own arrays, Segment objects would only be needed by pygame rendering
+            self.intersections = make_intersections(params, self.signals)
+        self.engine = ENGINES[engine](self.road_graph, self.segments, self.intersections, params, self.np_random)
 
         # current simulation status
         self.current_step = 0
-        self.reward_observation = RewardObservationWrapper(self.segments)
+        self.reward_observation = RewardObservationWrapper(self.engine)
+
+        # cell-level trajectory recording (see: trajectory.Trajectory for replay)
+        record_trajectory = params.get("record_trajectory")
+        self.trajectory_recorder = TrajectoryRecorder(record_trajectory, self) if record_trajectory else None
+
+        # streaming per-segment and per-intersection telemetry (see: telemetry.Telemetry)
+        telemetry = params.get("telemetry")
+        self.telemetry = Telemetry(telemetry, self, params.get("telemetry_flush_every", 200)) if telemetry else None
+
+        # layout of all dynamic state of the environment in a single buffer (see: get_state)
+        self.state_dtype = np.dtype([("engine", self.engine.state_dtype),
+                                     ("signals", self.signals.state_dtype),
+                                     ("current_step", np.int64),
+                                     ("rng", np.uint64, (RNG_STATE_SIZE,))], align=True)
 
         # render-specific parameters
         self.render_simulation = params.render
-        if self.render_simulation:
+        self.render_mode = params.get("render_mode", "human")
+        self.render_every = params.get("render_every", 1)
+        self.render_updates = 0
+        self.frame_renderer = None
+        self.frame_recorder = None
+        if self.render_simulation and self.render_mode == "rgb_array":
+            render_output = params.get("render_output")
+            if render_output is not None:
+                self.frame_recorder = FrameRecorder(render_output, fps=params.render_fps)
+        elif self.render_simulation:
+            import pygame
+
             self.render_scale_factor = params.render_scale_factor
             self.render_screen_size_scaled = tuple(
                 self.render_scale_factor * x for x in params.render_screen_size)
@@ -49,82 +112,148 @@ class GraphTrafficEnv(gym.Env):
             self.render_clock = pygame.time.Clock()
             pygame.init()
 
+        # opt-in profiling: instruments the objects above, nothing is changed when disabled
+        self.profiler = None
+        if params.get("profile", False):
+            self.profiler = Profiler()
+            self.profiler.instrument(self)
+
         # gym-specific attributes
-        self.action_space = gym.spaces.Discrete(self.num_red_durations ** self.num_intersections)
+        self.action_decoder = ActionDecoder(params.get("action_mode", "discrete"), self.num_red_durations,
+                                            self.num_intersections)
+        self.action_space = self.action_decoder.space
         self.observation_space = self.reward_observation.observation_space
         self.reward_range = self.reward_observation.reward_range
 
     def _set_up_road_graph(self, params):
-        self.intersections = [FourWayNoTurnsIntersection(i, params.red_durations, x, y,
-                                                         params.intersection_size) for i, (x, y) in
-                              enumerate(params.intersections)]
-
-        i = 0
-        # (100, 0, "r", 1, "l") is a segment of length 100 going
-        #                       from right side of intersection 0
-        #                       to left side of intersection 1
-        for (length, from_idx, from_side, to_idx, to_side) in params.segments:
-            segment = Segment(i, length, self.intersections[to_idx], to_side, **params)
-            self.segments.append(segment)
-            self.intersections[to_idx].add_entrance(to_side, segment)
-            self.intersections[from_idx].add_exit(from_side, segment)
-            i += 1
-
-        for intersection in self.intersections:
-            intersection.finalize()
-
-    def _action_int_to_action_array(self, action_int):
-        """Gets a string representation of the action_int in the base = number of red_durations.
-           Returns the numeric string left filled with num_intersections zeroes."""
-        action_str = (np.base_repr(action_int, base=self.num_red_durations)).zfill(self.num_intersections)
-
-        """Returns array of ints from action_str list of strings"""
-        return np.array(list(int(s) for s in list(action_str)))
-
-    def step(self, action_int):
+        self.intersections, self.segments = make_road_graph(params, self.np_random, self.signals)
+
+    def seed(self, seed=None):
+        return [seed_rng(self.np_random, seed)]
+
+    def get_state(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Snapshot of all dynamic state of the environment: cars (positions, velocities, cars passed between segments),
+        traffic lights, current step and random number generator, in a single contiguous buffer.
+
+        :param out: Buffer to write the snapshot into (e.g. one returned by previous get_state call).
+        :return: Array of state_dtype and shape () (state.tobytes() gives raw bytes), see: set_state.
+        """
+        state = np.zeros((), dtype=self.state_dtype) if out is None else out
+        self.engine.get_state(state["engine"])
+        self.signals.get_state(state["signals"])
+        state["current_step"] = self.current_step
+        get_rng_state(self.np_random, state["rng"])
+        return state
+
+    def set_state(self, state) -> None:
+        """
+        Restores a snapshot taken by get_state: simulation continues exactly as it would from the snapshot.
+
+        :param state: Array returned by get_state, or its raw bytes.
+        """
+        if not isinstance(state, np.ndarray):
+            state = np.frombuffer(state, dtype=self.state_dtype)
+        state = state.reshape(())
+        self.engine.set_state(state["engine"])
+        self.signals.set_state(state["signals"])
+        self.current_step = int(state["current_step"])
+        set_rng_state(self.np_random, state["rng"])
+
+    def step(self, action):
 
         # apply action into intersection(s)
-        action_array = self._action_int_to_action_array(action_int)
-        for intersection, action in zip(self.intersections, action_array):
-            intersection.set_action(action)
+        action_array = self.action_decoder.decode(action)
+        self.signals.set_actions(action_array)
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.start_step(action_array)
 
         self.reward_observation.reset()
 
-        for update in range(self.updates_per_step):
+        if self.fast_forward:
+            self._fast_forward_step()
+        else:
+            for update in range(self.updates_per_step):
 
-            if self.render_simulation:
-                self.render()
+                if self.render_simulation:
+                    if self.render_updates % self.render_every == 0:
+                        self._render_update()
+                    self.render_updates += 1
 
-            # update simulation
-            for s in self.segments:
-                s.update_first_phase()
-            for s in self.segments:
-                s.update_second_phase()
-            for i in self.intersections:
-                i.update()
+                # update simulation
+                self.engine.update(self.signals.phase)
+                if self.telemetry is not None:
+                    self.telemetry.update()
+                self.signals.advance()
 
-            self.reward_observation.update()
+                self.reward_observation.update()
+                if self.trajectory_recorder is not None:
+                    self.trajectory_recorder.record()
 
         self.current_step += 1
         done = self.current_step >= self.steps_per_episode
+        if self.telemetry is not None:
+            self.telemetry.end_step()
 
         reward, observation = self.reward_observation.values()
 
-        info = {"action_int": action_int,
+        info = {**({"action_int": action} if self.action_decoder.action_mode == "discrete" else {}),
                 "action_array": [self.red_durations_raw[act] for act in action_array],
-                **self.reward_observation.info()}
+                **{key: value[0] for key, value in self.reward_observation.info().items()},
+                **({"stats": self.profiler.stats()} if self.profiler is not None else {})}
 
-        return observation, reward[0], done, info
+        return observation[0], reward[0], done, info
 
-    def reset(self):
-        for s in self.segments:
-            s.reset()
+    def _fast_forward_step(self) -> None:
+        """
+        All updates of a step at once: traffic lights are known in advance (they change only with actions),
+        so the engine runs all updates together, without any per-update Python calls.
+        """
+        self.signals.advance(self.updates_per_step, out=self._phases)
+        self.engine.run(self._phases, self.reward_observation)
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+
+        self.engine.reset()
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.start_episode()
 
         self.current_step = 0
 
-        return self.reward_observation.reset()
+        return self.reward_observation.reset()[0]
+
+    def stats(self, reset: bool = False) -> dict:
+        """
+        :param reset: Reset timers and counters after reading them.
+        :return: Cumulative profiling timers and counters (see: profiling.Profiler), empty if profiling is disabled.
+        """
+        if self.profiler is None:
+            return {}
+        stats = self.profiler.stats()
+        if reset:
+            self.profiler.reset()
+        return stats
+
+    def _render_update(self) -> None:
+        if self.render_mode == "human":
+            self.render()
+        else:
+            frame = self.render("rgb_array")
+            if self.frame_recorder is not None:
+                self.frame_recorder.add(frame)
 
     def render(self, mode="human"):
+        if mode == "rgb_array":
+            if self.frame_renderer is None:
+                self.frame_renderer = FrameRenderer(self.road_graph, self.params.intersections,
+                                                    self.params.intersection_size, self.params.render_screen_size,
+                                                    self.params.render_scale_factor, self.params.render_light_mode)
+            return self.frame_renderer.render(self.engine.occupancy()[0], self.signals.phase)
+
+        import pygame
+
         self.render_clock.tick(self.render_fps)
 
         for intersection in self.intersections:
@@ -136,12 +265,30 @@ class GraphTrafficEnv(gym.Env):
         pygame.transform.scale(self.render_surface, self.render_screen_size_scaled, self.render_screen)
         pygame.display.flip()
 
+    def close(self):
+        if self.frame_recorder is not None:
+            self.frame_recorder.close()
+            self.frame_recorder = None
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+        self.engine.close()
+
 
 class RewardObservationWrapper:
-    def __init__(self, segments):
+    """
+    Accumulates reward and observation over updates of a step, separately for every copy of the road network
+    simulated by the engine (reward has shape (num_copies,), observation (num_copies, 2, num_segments)).
+    Works on metrics the engine keeps up to date during its update, so the cost does not depend on the number
+    of segments in Python calls.
+    """
+
+    def __init__(self, engine):
         # constants
-        self.segments: List[Segment] = segments
-        self.num_segments: int = len(segments)
+        self.engine = engine
+        self.num_copies: int = engine.num_copies
+        self.num_segments: int = engine.num_segments
 
         # mutable
         self.num_steps: int
@@ -149,49 +296,115 @@ class RewardObservationWrapper:
         self.observation: np.ndarray
         self._reset()
 
+        # preallocated buffers
+        self._num_cars_or_one = np.zeros((self.num_copies, self.num_segments), dtype=np.int64)
+        self._mean_velocity = np.zeros((self.num_copies, self.num_segments), dtype=np.float32)
+
         # gym-specific attributes
         obs_low = np.zeros(shape=(2, self.num_segments), dtype=np.float)
-        obs_high = np.array((np.full(shape=self.num_segments, fill_value=segments[0].max_v, dtype=np.float32),
-                             np.array([s.length for s in self.segments], dtype=np.float)))
+        obs_high = np.array((np.full(shape=self.num_segments, fill_value=engine.max_v, dtype=np.float32),
+                             np.array(engine.lengths, dtype=np.float)))
         self.observation_space = gym.spaces.Box(low=obs_low, high=obs_high, dtype=np.float)
         self.reward_range = (0, float("inf"))
 
     def _reset(self):
         self.num_steps = 0
-        self.reward = np.zeros(1, dtype=np.float32)
-        self.observation = np.zeros((2, self.num_segments), dtype=np.float32)
+        self.reward = np.zeros(self.num_copies, dtype=np.float32)
+        self.observation = np.zeros((self.num_copies, 2, self.num_segments), dtype=np.float32)
 
-    def _compute_reward_observation(self):
-        data_per_segment = np.array([(s.total_distance(), s.mean_velocity(), s.num_cars()) for s in self.segments],
-                                    dtype=np.float32).swapaxes(0, 1)
+    def _add_observation(self, observation) -> None:
+        """
+        Adds mean velocity and number of cars per segment after last update to observation.
+        """
+        np.maximum(self.engine.num_cars, 1, out=self._num_cars_or_one)
+        np.divide(self.engine.total_distance, self._num_cars_or_one, out=self._mean_velocity)
 
-        total_distance_per_segment = data_per_segment[0, :]
-        reward = np.sum(total_distance_per_segment)
-
-        observation = data_per_segment[1:3, :]
-
-        return reward, observation
+        observation[:, 0] += self._mean_velocity
+        observation[:, 1] += self.engine.num_cars
 
     def reset(self):
         self._reset()
 
-        _, observation = self._compute_reward_observation()
+        observation = np.zeros((self.num_copies, 2, self.num_segments), dtype=np.float32)
+        self._add_observation(observation)
         return observation
 
     def update(self) -> None:
         self.num_steps += 1
 
-        update_reward, update_observation = self._compute_reward_observation()
-
-        self.reward += update_reward
-        self.observation += update_observation
+        self.reward += np.sum(self.engine.total_distance, axis=-1)
+        self._add_observation(self.observation)
 
     def values(self):
         return self.reward, (self.observation / self.num_steps)
 
     def info(self) -> {}:
         total_distance = self.reward
-        total_num_cars = np.sum(self.observation[1, :])
+        total_num_cars = np.sum(self.observation[:, 1, :], axis=-1)
 
         return {"mean_speed": total_distance / total_num_cars,
                 "mean_n_cars": total_num_cars / self.num_steps}
+
+
+def seed_rng(rng: np.random.Generator, seed=None) -> int:
+    """
+    Seeds rng in place, so that all objects sharing it (segments, engine) draw from the new stream.
+
+    :return: Seed that was used (random one if seed is None).
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    rng.bit_generator.state = type(rng.bit_generator)(seed_sequence).state
+    return seed_sequence.entropy
+
+
+RNG_STATE_SIZE = 6
+
+
+def get_rng_state(rng: np.random.Generator, out: np.ndarray) -> None:
+    """
+    Writes state of rng (PCG64 or PCG64DXSM bit generator) into out (array of RNG_STATE_SIZE uint64).
+    """
+    state = rng.bit_generator.state
+    for i, value in enumerate((state["state"]["state"], state["state"]["inc"])):
+        out[2 * i] = value >> 64
+        out[2 * i + 1] = value & 0xFFFFFFFFFFFFFFFF
+    out[4] = state["has_uint32"]
+    out[5] = state["uinteger"]
+
+
+def set_rng_state(rng: np.random.Generator, state: np.ndarray) -> None:
+    """
+    Restores state of rng written by get_rng_state.
+    """
+    state = [int(value) for value in state]
+    rng.bit_generator.state = {"bit_generator": type(rng.bit_generator).__name__,
+                               "state": {"state": state[0] << 64 | state[1], "inc": state[2] << 64 | state[3]},
+                               "has_uint32": state[4],
+                               "uinteger": state[5]}
+
+
+def make_intersections(params, signals: SignalController) -> List[FourWayNoTurnsIntersection]:
+    return [FourWayNoTurnsIntersection(i, signals, x, y, params.intersection_size)
+            for i, (x, y) in enumerate(params.intersections)]
+
+
+def make_road_graph(params, rng: np.random.Generator,
+                    signals: SignalController) -> Tuple[List[FourWayNoTurnsIntersection], List[Segment]]:
+    intersections = make_intersections(params, signals)
+    segments = []
+
+    i = 0
+    # (100, 0, "r", 1, "l") is a segment of length 100 going
+    #                       from right side of intersection 0
+    #                       to left side of intersection 1
+    for (length, from_idx, from_side, to_idx, to_side) in params.segments:
+        segment = Segment(i, length, intersections[to_idx], to_side, rng=rng, **params)
+        segments.append(segment)
+        intersections[to_idx].add_entrance(to_side, segment)
+        intersections[from_idx].add_exit(from_side, segment)
+        i += 1
+
+    for intersection in intersections:
+        intersection.finalize()
+
+    return intersections, segments
@@ -1,9 +1,10 @@
 from abc import ABC
-from typing import List
 
-import pygame
+from gym_graph_traffic.envs.road_graph import NO_PHASE, PHASES, ROUTING
+from gym_graph_traffic.envs.signals import SignalController
 
 class Intersection(ABC):
+    __slots__ = ("idx", "entrances", "exits", "routing", "dest_dict")
 
     def __init__(self, idx):
         self.idx = idx
@@ -29,27 +30,23 @@ class Intersection(ABC):
     def can_i_go(self, from_idx) -> int:
         raise NotImplementedError
 
-    def pass_car(self, from_idx, car_position, car_velocity) -> None:
-        raise NotImplementedError
-
     def segment_draw_coords(self, length, to_side):
         raise NotImplementedError
 
 
 class FourWayNoTurnsIntersection(Intersection):
+    """
+    Geometry and routing of an intersection, its traffic light is an element of the arrays of a SignalController
+    (actions and updates of all traffic lights are applied there at once).
+    """
+    __slots__ = ("signals", "x", "y", "intersection_size")
 
-    def __init__(self, idx, red_durations: List[int], x, y, intersection_size):
+    def __init__(self, idx, signals: SignalController, x, y, intersection_size):
         super().__init__(idx)
 
-        self.red_durations = red_durations
-        self.routing = {"u": "d",
-                        "d": "u",
-                        "l": "r",
-                        "r": "l"}
+        self.signals = signals
+        self.routing = dict(ROUTING)
 
-        self.updates_until_state_change = -1
-        self.state = None
-        self.update()
         self.x = x
         self.y = y
         self.intersection_size = intersection_size
@@ -64,20 +61,27 @@ class FourWayNoTurnsIntersection(Intersection):
             destination_segment = self.exits[self.routing[dir_char]]
             self.dest_dict[segment.idx] = (dir_char, destination_segment)
 
-    def set_action(self, action) -> None:
-        self.updates_until_state_change = self.red_durations[action]
-        if self.updates_until_state_change == 0:
-            self.state = "lr"
-        else:
-            self.state = "ud"
+    @property
+    def state(self):
+        """
+        :return: Current phase (see: road_graph.PHASES), None before the first action.
+        """
+        phase = self.signals.phase[self.idx]
+        return None if phase == NO_PHASE else PHASES[phase]
+
+    @property
+    def updates_until_state_change(self) -> int:
+        return int(self.signals.updates_until_state_change[self.idx])
 
     def draw(self, surface, light_mode):
+        import pygame
+
         red = (253, 65, 30)
         red_width = 1
         road_color = (192, 192, 192) if light_mode else (100, 100, 100)
         pygame.draw.rect(surface, road_color,
                          pygame.Rect(self.x, self.y, self.intersection_size, self.intersection_size))
-        if self.state is "lr":
+        if self.state == "lr":
             pygame.draw.rect(surface, red,
                              pygame.Rect(self.x, self.y, self.intersection_size, red_width))
             pygame.draw.rect(surface, red,
@@ -102,18 +106,8 @@ class FourWayNoTurnsIntersection(Intersection):
 
         return to_direction[to_side]
 
-    def update(self) -> None:
-        if self.state is "ud":
-            self.updates_until_state_change -= 1
-            if self.updates_until_state_change == 0:
-                self.state = "lr"
-
     def can_i_go(self, from_idx) -> int:
         (source, dest) = self.dest_dict.get(from_idx, (None, None))
         if source in self.state and dest is not None:
             return dest.free_init_cells
         return 0
-
-    def pass_car(self, from_idx, car_position, car_velocity) -> None:
-        (_, dest) = self.dest_dict[from_idx]
-        dest.new_car_at = (car_position, car_velocity)
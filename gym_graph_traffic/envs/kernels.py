@@ -0,0 +1,250 @@
+"""
+Compiled kernels of VectorizedEngine (used when numba is installed, see: KERNEL_BACKEND in params.py).
+
+They work in place on the flat position/velocity buffers of the engine and take random draws as an argument,
+so for the same draws they produce exactly the same trajectories as the NumPy implementation.
+
+numba is imported and the kernels are compiled only when the numba backend is used (see: compile_kernels).
+"""
+import importlib.util
+
+import numpy as np
+
+KERNEL_BACKENDS = ("auto", "numpy", "numba")
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+
+# compiled kernels (None until compile_kernels is called)
+step_segment = None
+place_cars = None
+nagel_schreckenberg_step = None
+nagel_schreckenberg_step_partition = None
+free_init_cells = None
+free_init_cells_partition = None
+segment_metrics_partition = None
+run_updates = None
+
+
+def resolve_kernel_backend(kernel_backend: str) -> str:
+    """
+    :return: "numpy" or "numba" ("auto" picks numba when it is installed).
+    """
+    if kernel_backend not in KERNEL_BACKENDS:
+        raise ValueError(f"Unknown kernel backend: {kernel_backend} (available: {', '.join(KERNEL_BACKENDS)})")
+    if kernel_backend == "numba" and not NUMBA_AVAILABLE:
+        raise ImportError("numba kernel backend requested, but numba is not installed")
+    if kernel_backend == "auto":
+        kernel_backend = "numba" if NUMBA_AVAILABLE else "numpy"
+    if kernel_backend == "numba":
+        compile_kernels()
+    return kernel_backend
+
+
+def compile_kernels() -> None:
+    """
+    Imports numba and compiles the kernels (once, compiled code is also cached on disk).
+    """
+    global step_segment, place_cars, nagel_schreckenberg_step, nagel_schreckenberg_step_partition, free_init_cells, \
+        free_init_cells_partition, segment_metrics_partition, run_updates
+    if run_updates is not None:
+        return
+
+    # kernels do not hold the GIL, so partitions of a network can be processed by several threads at once
+    import numba
+    jit = numba.njit(cache=True, nogil=True)
+    step_segment = jit(_step_segment)
+    place_cars = jit(_place_cars)
+    nagel_schreckenberg_step = jit(_nagel_schreckenberg_step)
+    nagel_schreckenberg_step_partition = jit(_nagel_schreckenberg_step_partition)
+    free_init_cells = jit(_free_init_cells)
+    free_init_cells_partition = jit(_free_init_cells_partition)
+    segment_metrics_partition = jit(_segment_metrics_partition)
+    run_updates = jit(_run_updates)
+
+
+def _step_segment(p, v, start, end, next_offset, extension, last_car_rank, slow_down, max_v, pending_cell,
+                  pending_v, num_pending) -> int:
+    """
+    Nagel-Schreckenberg step of a single segment (cells start:end). Cars are processed from the last one (closest
+    to the end of the segment) to the first one and moved in place; a car crossing the intersection is appended to
+    pending_cell/pending_v instead (see: place_cars).
+
+    :param last_car_rank: Index of the slow down of the last car of the segment.
+    :return: Number of pending cars.
+    """
+    rank = last_car_rank
+    car_ahead = -1
+
+    for c in range(end - 1, start - 1, -1):
+        if p[c] == 0:
+            continue
+
+        # 1. Acceleration
+        vel = min(v[c] + 1, max_v)
+
+        # 2. Slowing down
+        if car_ahead < 0:
+            free_cells = end - c - 1 + extension
+        else:
+            free_cells = car_ahead - c - 1
+        vel = min(vel, free_cells)
+
+        # 3. Randomization
+        vel = max(vel - slow_down[rank], 0)
+        rank -= 1
+
+        # 4. Car motion
+        car_ahead = c
+        p[c] = 0
+        v[c] = 0
+        new_c = c + vel
+        if new_c >= end:
+            pending_cell[num_pending] = next_offset + new_c - end
+            pending_v[num_pending] = vel
+            num_pending += 1
+        else:
+            p[new_c] = 1
+            v[new_c] = vel
+    return num_pending
+
+
+def _place_cars(p, v, pending_cell, pending_v, num_pending) -> None:
+    """
+    Places cars that crossed intersections in the following segments (after all segments were processed, so they are
+    not moved twice). Cars with negative cells left the network (see: boundary).
+    """
+    for i in range(num_pending):
+        if pending_cell[i] >= 0:
+            p[pending_cell[i]] = 1
+            v[pending_cell[i]] = pending_v[i]
+
+
+def _nagel_schreckenberg_step(p, v, offsets, ends, next_offsets, extension, num_cars, slow_down, max_v,
+                              pending_cell, pending_v, crossed) -> int:
+    """
+    Nagel-Schreckenberg step of all segments (see: step_segment), cars crossing intersections are placed in the
+    following segments after all segments are processed.
+
+    :param num_cars: Number of cars per segment (before the step).
+    :param slow_down: 1 for every car that randomly slows down, in order of cars in the flat buffers.
+    :param crossed: Output, number of cars that left every segment.
+    :return: Number of cars that crossed intersections.
+    """
+    num_pending = 0
+    first_car_rank = 0
+    for s in range(offsets.size):
+        before = num_pending
+        num_pending = step_segment(p, v, offsets[s], ends[s], next_offsets[s], extension[s],
+                                   first_car_rank + num_cars[s] - 1, slow_down, max_v, pending_cell, pending_v,
+                                   num_pending)
+        crossed[s] = num_pending - before
+        first_car_rank += num_cars[s]
+
+    place_cars(p, v, pending_cell, pending_v, num_pending)
+    return num_pending
+
+
+def _nagel_schreckenberg_step_partition(p, v, segments, offsets, ends, next_offsets, extension, num_cars,
+                                        first_car_rank, slow_down, max_v, pending_cell, pending_v, crossed) -> int:
+    """
+    Nagel-Schreckenberg step of a partition of the network (see: road_graph.spatial_partitions). Cars crossing
+    intersections are only kept in pending_cell/pending_v: they are placed by place_cars once all partitions
+    are processed.
+
+    :param segments: Segments of the partition.
+    :param first_car_rank: Index of the slow down of the first car of every segment (of the whole network).
+    :return: Number of pending cars.
+    """
+    num_pending = 0
+    for s in segments:
+        before = num_pending
+        num_pending = step_segment(p, v, offsets[s], ends[s], next_offsets[s], extension[s],
+                                   first_car_rank[s] + num_cars[s] - 1, slow_down, max_v, pending_cell, pending_v,
+                                   num_pending)
+        crossed[s] = num_pending - before
+    return num_pending
+
+
+def _free_init_cells(p, offsets, lengths, max_v, free_init_cells) -> None:
+    """
+    Number of free cells at the beginning of every segment (at most max_v).
+    """
+    for s in range(offsets.size):
+        i = 0
+        limit = min(max_v, lengths[s])
+        while i < limit and p[offsets[s] + i] != 1:
+            i += 1
+        free_init_cells[s] = i
+
+
+def _free_init_cells_partition(p, segments, offsets, lengths, max_v, free_init_cells) -> None:
+    """
+    Same as free_init_cells for segments of a partition.
+    """
+    for s in segments:
+        i = 0
+        limit = min(max_v, lengths[s])
+        while i < limit and p[offsets[s] + i] != 1:
+            i += 1
+        free_init_cells[s] = i
+
+
+def _segment_metrics_partition(p, v, segments, offsets, ends, total_distance, num_cars) -> None:
+    """
+    Total distance covered by cars and number of cars of segments of a partition.
+    """
+    for s in segments:
+        distance = 0
+        cars = 0
+        for c in range(offsets[s], ends[s]):
+            distance += v[c]
+            cars += p[c]
+        total_distance[s] = distance
+        num_cars[s] = cars
+
+
+def _run_updates(p, v, offsets, ends, next_offsets, next_segment, has_next_segment, to_intersection, to_side,
+                 phase_green, phases, lengths, max_v, num_segments, slow_down, free_cells, total_distance,
+                 num_cars, extension, pending_cell, pending_v, crossed, reward, observation) -> None:
+    """
+    Several updates of all segments fused into a single loop: every update is followed by accumulation of reward
+    and observation (see: RewardObservationWrapper.update, including float32 rounding after every update).
+
+    :param phases: Traffic light phase codes of every update, shape (num_updates, num_copies * num_intersections).
+    :param slow_down: Random slow downs of all updates (number of cars does not change during updates).
+    :param free_cells: Free init cells of every segment, updated in place.
+    :param num_cars: Number of cars per segment (before the first update), updated in place with total_distance.
+    """
+    num_updates = phases.shape[0]
+    cars_per_update = slow_down.size // num_updates
+    for u in range(num_updates):
+        # extend every segment by free cells of the following one (if it has green light)
+        for s in range(offsets.size):
+            if has_next_segment[s] and phase_green[phases[u, to_intersection[s]], to_side[s]]:
+                extension[s] = free_cells[next_segment[s]]
+            else:
+                extension[s] = 0
+
+        nagel_schreckenberg_step(p, v, offsets, ends, next_offsets, extension, num_cars,
+                                 slow_down[u * cars_per_update:(u + 1) * cars_per_update], max_v,
+                                 pending_cell, pending_v, crossed)
+        free_init_cells(p, offsets, lengths, max_v, free_cells)
+
+        # metrics of every segment, accumulated reward and observation of every copy
+        copy_distance = 0
+        for s in range(offsets.size):
+            distance = 0
+            cars = 0
+            for c in range(offsets[s], ends[s]):
+                distance += v[c]
+                cars += p[c]
+            total_distance[s] = distance
+            num_cars[s] = cars
+
+            copy, segment = s // num_segments, s % num_segments
+            observation[copy, 0, segment] += np.float32(distance / max(cars, 1))
+            observation[copy, 1, segment] = np.float64(observation[copy, 1, segment]) + cars
+            copy_distance += distance
+            if segment == num_segments - 1:
+                reward[copy] = np.float64(reward[copy]) + copy_distance
+                copy_distance = 0
+
@@ -0,0 +1,49 @@
+"""
+.npy files that are appended to while they are written (frames, telemetry records, sweep results).
+
+Their header has a fixed size, so it can be rewritten in place with the current shape after every write: the file
+stays a valid .npy file (np.load(..., mmap_mode="r")) while data keeps being appended after the header.
+"""
+from typing import BinaryIO, Tuple
+
+import numpy as np
+
+# version of the .npy format (header length in 2 bytes)
+NPY_VERSION = (1, 0)
+# largest length of an axis a header has room for (see: npy_header_size)
+MAX_AXIS_LENGTH = 10 ** 15
+
+
+def _header_dict(dtype, shape: Tuple[int, ...]) -> str:
+    return repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+                 "shape": tuple(int(n) for n in shape)})
+
+
+def npy_header_size(dtype, ndim: int) -> int:
+    """
+    :return: Size of a header with room for any shape of ndim axes (a multiple of 64 bytes, so data are aligned
+             as in files written by NumPy).
+    """
+    prefix = len(np.lib.format.magic(*NPY_VERSION)) + 2
+    length = prefix + len(_header_dict(dtype, (MAX_AXIS_LENGTH,) * ndim)) + 1
+    return -(-length // np.lib.format.ARRAY_ALIGN) * np.lib.format.ARRAY_ALIGN
+
+
+def write_npy_header(file: BinaryIO, dtype, shape: Tuple[int, ...], size: int) -> None:
+    """
+    Writes a header of the given size at the beginning of the file. The position in the file is kept (and moved past
+    the header if it was inside it).
+
+    :param size: Size of the header, see: npy_header_size.
+    """
+    magic = np.lib.format.magic(*NPY_VERSION)
+    header = _header_dict(dtype, shape)
+    header_len = size - len(magic) - 2
+    if len(header) + 1 > header_len:
+        raise ValueError(f".npy header of shape {shape} does not fit into {size} bytes")
+
+    position = file.tell()
+    file.seek(0)
+    # header is padded with spaces and terminated by a newline
+    file.write(magic + header_len.to_bytes(2, "little") + header.ljust(header_len - 1).encode("latin1") + b"\n")
+    file.seek(max(position, size))
@@ -1,3 +1,6 @@
+from collections.abc import Mapping
+from functools import partial
+
 from attrdict import AttrDict
 
 from util import grid
@@ -8,6 +11,7 @@ STEPS_PER_EPISODE = 200
 SECONDS_PER_UPDATE = 2.7
 STEP_LENGTH = 60  # in seconds
 RED_DURATIONS = [0, 20, 40, 60]  # table of all possible red durations (see: README)
+ACTION_MODE = "discrete"  # "discrete" (single int) or "multi_discrete" (red duration index per intersection)
 
 # cars' movement
 MAX_SPEED = 5  # in cells per update
@@ -17,31 +21,110 @@ PROB_SLOW_DOWN = 0.1
 PRESET = "easy"  # see PRESETS dictionary below
 SEGMENT_LENGTH = 100  # in cells
 CAR_DENSITY = 0.125
+ROUTES = None  # None (straight through), "turns" (TURN_PROBABILITIES) or "od" (shortest routes to random destinations)
+TURN_PROBABILITIES = (0.2, 0.6, 0.2)  # left turn, straight through, right turn (of every entrance, for "turns")
+OPEN_BOUNDARY = False  # cars arrive at boundary segments and leave the network instead of entering them
+BOUNDARY_SEGMENTS = None  # segments of the open boundary (None: segments wrapping around the network)
+ARRIVAL_RATES = 0.1  # cars per update of every boundary segment: a rate, a rate per segment or a demand profile
+DEMAND_PERIOD = 1  # steps every row of a demand profile (ARRIVAL_RATES of shape (rows, segments)) lasts
+
+# simulation engine
+ENGINE = "segments"  # "segments" (per-segment reference implementation) or "vectorized" (whole-network arrays)
+KERNEL_BACKEND = "auto"  # vectorized engine kernels: "numpy", "numba" or "auto" (numba if installed)
+FAST_FORWARD = False  # run all updates of a step at once (no rendering and trajectory recording)
+PARTITIONS = 1  # vectorized engine (numba): spatial partitions of the road network stepped in parallel threads
+PROFILE = False  # per-phase timers and counters (see: env.stats()), no overhead when disabled
+
+# random number generator
+SEED = None  # seed of the environment (None: random); can also be set with env.seed() or env.reset(seed=...)
+
+# trajectory recording
+RECORD_TRAJECTORY = None  # directory cell-level trajectories of episodes are recorded to (None: not recorded)
+
+# telemetry
+TELEMETRY = None  # directory per-segment and per-intersection statistics are flushed to (None: disabled)
+TELEMETRY_FLUSH_EVERY = 200  # steps between flushes of telemetry
 
 # rendering
 RENDER = False
 RENDER_LIGHT_MODE = True
 RENDER_FPS = 30
+RENDER_MODE = "human"  # "human" (pygame window) or "rgb_array" (headless NumPy frames, see: RENDER_OUTPUT)
+RENDER_EVERY = 1  # render every k-th update
+RENDER_OUTPUT = None  # "rgb_array" mode: .npy or video file the frames are recorded to (None: not recorded)
+
+
+class LazyPresets(Mapping):
+    """
+    Presets are built on first access and memoized, so importing params does not build every road network.
+    """
+
+    def __init__(self, factories: dict):
+        self._factories = factories
+        self._presets = {}
+
+    def __getitem__(self, name: str) -> dict:
+        if name not in self._presets:
+            self._presets[name] = self._factories[name]()
+        return self._presets[name]
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def __len__(self) -> int:
+        return len(self._factories)
+
+
+PRESETS = LazyPresets({
+    "easy": partial(grid.make_line, 4, False, 3, segment_len=SEGMENT_LENGTH),
+    "grid_4x2": partial(grid.make_grid, 4, 2, 4, segment_len=SEGMENT_LENGTH),
+    "grid_3x3": partial(grid.make_grid, 3, 3, 2, segment_len=SEGMENT_LENGTH),
+    "two_roads": partial(grid.make_line, 4, True, 3, segment_len=SEGMENT_LENGTH),
+})
+
+
+def make_parameters() -> AttrDict:
+    return AttrDict({"preset_name": PRESET,
+                     **PRESETS[PRESET],
+                     "steps_per_episode": STEPS_PER_EPISODE,
+                     "updates_per_step": int(STEP_LENGTH / SECONDS_PER_UPDATE),
+                     "car_density": CAR_DENSITY,
+                     "max_v": MAX_SPEED,
+                     "prob_slow_down": PROB_SLOW_DOWN,
+                     "routes": ROUTES,
+                     "turn_probabilities": TURN_PROBABILITIES,
+                     "open_boundary": OPEN_BOUNDARY,
+                     "boundary_segments": BOUNDARY_SEGMENTS,
+                     "arrival_rates": ARRIVAL_RATES,
+                     "demand_period": DEMAND_PERIOD,
+                     "engine": ENGINE,
+                     "kernel_backend": KERNEL_BACKEND,
+                     "fast_forward": FAST_FORWARD,
+                     "partitions": PARTITIONS,
+                     "profile": PROFILE,
+                     "seed": SEED,
+                     "red_durations": [int(o / SECONDS_PER_UPDATE) for o in RED_DURATIONS],
+                     "red_durations_raw": RED_DURATIONS,
+                     "action_mode": ACTION_MODE,
+                     "record_trajectory": RECORD_TRAJECTORY,
+                     "telemetry": TELEMETRY,
+                     "telemetry_flush_every": TELEMETRY_FLUSH_EVERY,
+                     "render": RENDER,
+                     "render_light_mode": RENDER_LIGHT_MODE,
+                     "render_fps": RENDER_FPS,
+                     "render_mode": RENDER_MODE,
+                     "render_every": RENDER_EVERY,
+                     "render_output": RENDER_OUTPUT,
+                     "intersection_size": INTERSECTION_SIZE})
+
+
+def __getattr__(name: str):
+    # PARAMETERS are built on first access (see: PRESETS)
+    if name == "PARAMETERS":
+        global PARAMETERS
+        PARAMETERS = make_parameters()
+        return PARAMETERS
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-PRESETS = {
-    "easy": grid.make_line(4, False, 3, segment_len=SEGMENT_LENGTH),
-    "grid_4x2": grid.make_grid(4, 2, 4, segment_len=SEGMENT_LENGTH),
-    "grid_3x3": grid.make_grid(3, 3, 2, segment_len=SEGMENT_LENGTH),
-    "two_roads": grid.make_line(4, True, 3, segment_len=SEGMENT_LENGTH),
-}
-
-PARAMETERS = AttrDict({"preset_name": PRESET,
-                       **PRESETS[PRESET],
-                       "steps_per_episode": STEPS_PER_EPISODE,
-                       "updates_per_step": int(STEP_LENGTH / SECONDS_PER_UPDATE),
-                       "car_density": CAR_DENSITY,
-                       "max_v": MAX_SPEED,
-                       "prob_slow_down": PROB_SLOW_DOWN,
-                       "red_durations": [int(o / SECONDS_PER_UPDATE) for o in RED_DURATIONS],
-                       "red_durations_raw": RED_DURATIONS,
-                       "render": RENDER,
-                       "render_light_mode": RENDER_LIGHT_MODE,
-                       "render_fps": RENDER_FPS,
-                       "intersection_size": INTERSECTION_SIZE})
 
 assert all(0 <= off <= STEP_LENGTH for off in RED_DURATIONS)
@@ -0,0 +1,86 @@
+"""
+Opt-in profiling of GraphTrafficEnv (see: PROFILE in params.py).
+
+Profiler instruments a single environment by rebinding methods of its objects (engine, traffic lights, reward
+wrapper) with timed/counting wrappers, so environments without profiling run exactly the same code as before.
+"""
+from time import perf_counter
+
+import numpy as np
+
+TIMERS = ("update_first_phase", "update_second_phase", "intersections_update", "reward_update", "render",
+          "fast_forward")
+COUNTERS = ("updates", "cars_passed", "blocked_entries", "reallocations")
+
+
+class Profiler:
+    """
+    Cumulative timers (in seconds) of every phase of an update, and counters:
+
+    - updates - number of updates,
+    - cars_passed - cars that crossed intersections,
+    - blocked_entries - segments that could not pass any car to the following segment (can_i_go == 0),
+    - reallocations - arrays holding cars that were reallocated by an update phase.
+
+    fast_forward is the total time of fast-forwarded steps (it includes the phases above, unless all updates of a step
+    run as a single kernel, see: VectorizedEngine.fuses_run; then only this time and the number of updates are
+    measured).
+    """
+
+    def __init__(self):
+        self.timers = dict.fromkeys(TIMERS, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def reset(self) -> None:
+        self.timers.update(dict.fromkeys(TIMERS, 0.0))
+        self.counters.update(dict.fromkeys(COUNTERS, 0))
+
+    def stats(self) -> dict:
+        return {"timers": dict(self.timers), "counters": dict(self.counters)}
+
+    def instrument(self, env) -> None:
+        engine = env.engine
+        fused = engine.fuses_run
+
+        self._wrap(engine, "update_first_phase", "update_first_phase", self._count_cars_passed, engine)
+        self._wrap(engine, "update_second_phase", "update_second_phase", self._count_update, engine)
+        self._wrap(engine, "extension", None, self._count_blocked_entries)
+        self._wrap(engine, "run", "fast_forward", self._count_fused_updates if fused else None)
+        self._wrap(env.signals, "advance", "intersections_update")
+        self._wrap(env.reward_observation, "update", "reward_update")
+        self._wrap(env, "_render_update", "render")
+
+    def _wrap(self, obj, method: str, timer: str = None, count=None, buffers_of=None) -> None:
+        """
+        Rebinds obj.method with a wrapper that adds its time to the timer, calls count(result, *args) and counts
+        reallocations of buffers_of.buffers().
+        """
+        original = getattr(obj, method)
+        timers = self.timers
+        counters = self.counters
+
+        def wrapper(*args, **kwargs):
+            buffers = buffers_of.buffers() if buffers_of is not None else None
+            start = perf_counter()
+            result = original(*args, **kwargs)
+            if timer is not None:
+                timers[timer] += perf_counter() - start
+            if count is not None:
+                count(result, *args)
+            if buffers is not None:
+                counters["reallocations"] += sum(a is not b for a, b in zip(buffers, buffers_of.buffers()))
+            return result
+
+        setattr(obj, method, wrapper)
+
+    def _count_cars_passed(self, cars_passed, *args) -> None:
+        self.counters["cars_passed"] += cars_passed
+
+    def _count_blocked_entries(self, extension: np.ndarray, *args) -> None:
+        self.counters["blocked_entries"] += int(np.count_nonzero(extension == 0))
+
+    def _count_update(self, result, *args) -> None:
+        self.counters["updates"] += 1
+
+    def _count_fused_updates(self, result, phases, *args) -> None:
+        self.counters["updates"] += len(phases)
@@ -0,0 +1,466 @@
+"""
+Remote environments: an asyncio server hosting batches of GraphTrafficEnvs, and client proxies that step them.
+
+Every client connection opens a session of num_envs environments on the server. Actions, observations, rewards and
+info fields of the whole batch are exchanged as raw NumPy buffers: a frame is a fixed header, a short JSON
+description of the arrays (name, dtype, shape) and the arrays' bytes, written straight from (and read straight into)
+array memory, without pickling. Environments of a session are stepped in a worker thread, so the server keeps
+serving other clients meanwhile.
+
+    python -m gym_graph_traffic.envs.remote --preset grid_3x3 --port 5555
+
+    envs = RemoteVectorGraphTrafficEnv(("localhost", 5555), num_envs=64)
+"""
+import argparse
+import asyncio
+import json
+import socket
+import struct
+import threading
+from typing import Dict, List, Tuple, Union
+
+import gym
+import numpy as np
+
+from gym_graph_traffic.envs.actions import ActionDecoder
+from gym_graph_traffic.envs.graph_traffic import GraphTrafficEnv
+from gym_graph_traffic.envs.vector_graph_traffic import INFO_FIELDS, env_seeds, step_infos
+
+COMMANDS = ("make", "reset", "step", "seed", "close", "error")
+COMMAND_CODES = {command: code for code, command in enumerate(COMMANDS)}
+
+# command, length of the JSON metadata, length of the payload (arrays)
+HEADER = struct.Struct("<BIQ")
+# arrays in the payload are aligned to 8 bytes
+ALIGNMENT = 8
+
+# parameters clients may override, everything else (e.g. output paths, rendering) is fixed by the server
+CLIENT_PARAMS = ("seed", "engine", "kernel_backend", "fast_forward", "action_mode")
+# limits of a client's requests: environments of a session, bytes of a frame's metadata and payload
+MAX_NUM_ENVS = 1024
+MAX_METADATA_SIZE = 1 << 16
+MAX_PAYLOAD_SIZE = 1 << 26
+
+Address = Union[Tuple[str, int], str]
+
+
+def encode(command: str, metadata: dict = None, arrays: Dict[str, np.ndarray] = None) -> list:
+    """
+    :return: Buffers of the frame (header, metadata, arrays and their padding), to be written one after another.
+             Arrays are not copied: their memory is written as is.
+    """
+    metadata = dict(metadata or {})
+    buffers = []
+    descriptions = []
+    payload_len = 0
+    for name, array in (arrays or {}).items():
+        array = np.ascontiguousarray(array)
+        descriptions.append((name, array.dtype.str, array.shape))
+        buffers.append(memoryview(array).cast("B"))
+        padding = -array.nbytes % ALIGNMENT
+        if padding:
+            buffers.append(bytes(padding))
+        payload_len += array.nbytes + padding
+    metadata["arrays"] = descriptions
+    metadata = json.dumps(metadata).encode()
+    return [HEADER.pack(COMMAND_CODES[command], len(metadata), payload_len), metadata, *buffers]
+
+
+def decode(metadata: bytes, payload) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    :param payload: Bytes of the arrays (see: encode).
+    :return: Metadata and arrays of the frame; arrays are views of the payload.
+    """
+    metadata = json.loads(metadata)
+    arrays = {}
+    offset = 0
+    for name, dtype, shape in metadata.pop("arrays"):
+        array = np.frombuffer(payload, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+        arrays[name] = array
+        offset += array.nbytes + (-array.nbytes % ALIGNMENT)
+    return metadata, arrays
+
+
+class Session:
+    """
+    Batch of GraphTrafficEnvs of a single client. Results of every step are written into preallocated arrays,
+    which are sent to the client as they are.
+    """
+
+    def __init__(self, params, num_envs: int, auto_reset: bool = True):
+        """
+        :param auto_reset: Reset environments at the end of their episodes (observation of the last step is then
+                           returned as terminal_observation).
+        """
+        self.auto_reset = auto_reset
+        self.envs = []
+        for index in range(num_envs):
+            # every environment gets its own seed (if any)
+            env_params = params
+            if params.get("seed") is not None:
+                env_params = {**params, "seed": params["seed"] + index}
+            self.envs.append(GraphTrafficEnv(env_params))
+
+        env = self.envs[0]
+        shape = env.observation_space.shape
+        self.arrays = {"observation": np.zeros((num_envs, *shape), dtype=np.float32),
+                       "terminal_observation": np.zeros((num_envs, *shape), dtype=np.float32),
+                       "reward": np.zeros(num_envs, dtype=np.float32),
+                       "done": np.zeros(num_envs, dtype=np.bool_),
+                       **{key: np.zeros(num_envs, dtype=np.float32) for key in INFO_FIELDS}}
+        self.description = {"num_envs": num_envs,
+                            "action_mode": env.action_decoder.action_mode,
+                            "num_red_durations": env.num_red_durations,
+                            "num_intersections": env.num_intersections,
+                            "red_durations_raw": list(env.red_durations_raw)}
+        self.observation_high = np.asarray(env.observation_space.high)
+
+    def reset(self) -> Dict[str, np.ndarray]:
+        for i, env in enumerate(self.envs):
+            self.arrays["observation"][i] = env.reset()
+        return {"observation": self.arrays["observation"]}
+
+    def seed(self, seeds: List[int]) -> None:
+        for env, seed in zip(self.envs, seeds):
+            env.seed(seed)
+
+    def step(self, actions: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        :param actions: Action of every environment of the session.
+        """
+        shape = (len(self.envs), *self.envs[0].action_space.shape)
+        if actions.shape != shape:
+            raise ValueError(f"Actions of shape {actions.shape} do not match the session (expected: {shape})")
+        arrays = self.arrays
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            observation, reward, done, info = env.step(action)
+            if done and self.auto_reset:
+                arrays["terminal_observation"][i] = observation
+                observation = env.reset()
+            arrays["observation"][i] = observation
+            arrays["reward"][i] = reward
+            arrays["done"][i] = done
+            for key in INFO_FIELDS:
+                arrays[key][i] = info[key]
+        return arrays
+
+    def close(self) -> None:
+        for env in self.envs:
+            env.close()
+
+
+class EnvServer:
+    """
+    Hosts sessions of GraphTrafficEnvs (see: Session) for clients connected over TCP or a Unix socket.
+    """
+
+    def __init__(self, params, address: Address = ("localhost", 0), max_num_envs: int = MAX_NUM_ENVS):
+        """
+        :param params: Parameters of hosted environments (clients can override those in CLIENT_PARAMS).
+        :param address: (host, port) to listen on (port 0: any free port), or path of a Unix socket.
+        :param max_num_envs: Maximal number of environments of a session.
+        """
+        self.params = dict(params)
+        self.address = address
+        self.max_num_envs = max_num_envs
+        self._server = None
+        self._loop = None
+
+    async def start(self) -> None:
+        if isinstance(self.address, str):
+            self._server = await asyncio.start_unix_server(self._handle, self.address)
+        else:
+            self._server = await asyncio.start_server(self._handle, *self.address)
+            self.address = self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def run_in_thread(self) -> threading.Thread:
+        """
+        Serves in a daemon thread with its own event loop, returns once the server is listening
+        (e.g. for clients in the same process, or tests on localhost).
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            try:
+                self._loop.run_until_complete(self.serve_forever())
+            except asyncio.CancelledError:
+                pass  # closed
+            finally:
+                self._loop.close()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        started.wait()
+        return thread
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._server.close)
+        else:
+            self._server.close()
+
+    def _session_params(self, overrides: dict) -> dict:
+        """
+        :return: Parameters of the server with overrides of a client (only those in CLIENT_PARAMS).
+        """
+        rejected = sorted(set(overrides) - set(CLIENT_PARAMS))
+        if rejected:
+            raise ValueError(f"Parameters cannot be overridden by clients: {', '.join(rejected)} "
+                             f"(allowed: {', '.join(CLIENT_PARAMS)})")
+        return {**self.params, **overrides}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        session = None
+        try:
+            while True:
+                try:
+                    command, metadata_len, payload_len = HEADER.unpack(await reader.readexactly(HEADER.size))
+                except asyncio.IncompleteReadError:
+                    break
+                if command >= len(COMMANDS) or metadata_len > MAX_METADATA_SIZE or payload_len > MAX_PAYLOAD_SIZE:
+                    # the rest of the stream cannot be trusted to be framed correctly
+                    writer.writelines(encode("error", {"error": "ValueError: Invalid or oversized frame"}))
+                    await writer.drain()
+                    break
+                try:
+                    metadata, payload = await reader.readexactly(metadata_len), await reader.readexactly(payload_len)
+                except asyncio.IncompleteReadError:
+                    break
+                command = COMMANDS[command]
+
+                if command == "close":
+                    writer.writelines(encode("close"))
+                    await writer.drain()
+                    break
+
+                try:
+                    # malformed frames (JSON, dtypes or shapes not matching the payload) are answered with an error
+                    metadata, arrays = decode(metadata, payload)
+                    if command == "make":
+                        if session is not None:
+                            await loop.run_in_executor(None, session.close)
+                        params = self._session_params(metadata.get("params", {}))
+                        num_envs = metadata["num_envs"]
+                        if not isinstance(num_envs, int) or not 0 < num_envs <= self.max_num_envs:
+                            raise ValueError(f"num_envs must be an integer in [1, {self.max_num_envs}]")
+                        session = await loop.run_in_executor(None, Session, params, num_envs,
+                                                             metadata.get("auto_reset", True))
+                        reply = encode("make", session.description, {"observation_high": session.observation_high})
+                    elif session is None:
+                        raise ValueError(f"{command} before make")
+                    elif command == "step":
+                        reply = encode("step", arrays=await loop.run_in_executor(None, session.step,
+                                                                                 arrays["actions"]))
+                    elif command == "reset":
+                        reply = encode("reset", arrays=await loop.run_in_executor(None, session.reset))
+                    elif command == "seed":
+                        session.seed(metadata["seeds"])
+                        reply = encode("seed")
+                    else:
+                        raise ValueError(f"Unknown command: {command}")
+                except Exception as e:
+                    reply = encode("error", {"error": f"{type(e).__name__}: {e}"})
+
+                writer.writelines(reply)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if session is not None:
+                await loop.run_in_executor(None, session.close)
+            writer.close()
+
+
+class Connection:
+    """
+    Blocking client side of the protocol. Frames are sent with scatter/gather writes straight from array memory
+    and received into a reusable buffer: returned arrays are views of it, valid until the next request.
+    """
+
+    def __init__(self, address: Address):
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        else:
+            self.socket = socket.create_connection(address)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._header = bytearray(HEADER.size)
+        self._buffer = bytearray(1 << 16)
+
+    def send(self, command: str, metadata: dict = None, arrays: Dict[str, np.ndarray] = None) -> None:
+        buffers = [memoryview(buffer).cast("B") for buffer in encode(command, metadata, arrays)]
+        while buffers:
+            sent = self.socket.sendmsg(buffers)
+            while buffers and sent >= buffers[0].nbytes:
+                sent -= buffers[0].nbytes
+                buffers.pop(0)
+            if buffers:
+                buffers[0] = buffers[0][sent:]
+
+    def receive(self, command: str) -> Tuple[dict, Dict[str, np.ndarray]]:
+        """
+        :return: Metadata and arrays of the reply to the command.
+        """
+        self._receive_into(memoryview(self._header))
+        code, metadata_len, payload_len = HEADER.unpack(self._header)
+        size = metadata_len + payload_len
+        if size > len(self._buffer):
+            self._buffer = bytearray(size)
+        frame = memoryview(self._buffer)[:size]
+        self._receive_into(frame)
+        metadata, arrays = decode(frame[:metadata_len].tobytes(), frame[metadata_len:])
+
+        if COMMANDS[code] == "error":
+            raise RuntimeError(f"Remote environment failed: {metadata['error']}")
+        if COMMANDS[code] != command:
+            raise RuntimeError(f"Unexpected reply: {COMMANDS[code]} (expected: {command})")
+        return metadata, arrays
+
+    def request(self, command: str, metadata: dict = None, arrays: Dict[str, np.ndarray] = None):
+        self.send(command, metadata, arrays)
+        return self.receive(command)
+
+    def _receive_into(self, view: memoryview) -> None:
+        while view.nbytes:
+            received = self.socket.recv_into(view)
+            if received == 0:
+                raise ConnectionError("Connection closed by the server")
+            view = view[received:]
+
+    def close(self) -> None:
+        try:
+            self.request("close")
+        except (ConnectionError, OSError):
+            pass
+        self.socket.close()
+
+
+def _make_session(connection: Connection, num_envs: int, params: dict, auto_reset: bool):
+    """
+    :return: Description of the session, observation space and action decoder of its environments.
+    """
+    description, arrays = connection.request("make", {"num_envs": num_envs, "params": params or {},
+                                                      "auto_reset": auto_reset})
+    high = np.array(arrays["observation_high"])
+    observation_space = gym.spaces.Box(low=np.zeros_like(high), high=high, dtype=high.dtype)
+    action_decoder = ActionDecoder(description["action_mode"], description["num_red_durations"],
+                                   description["num_intersections"])
+    return description, observation_space, action_decoder
+
+
+class RemoteVectorGraphTrafficEnv(gym.vector.VectorEnv):
+    """
+    num_envs GraphTrafficEnvs hosted by an EnvServer, with gym's VectorEnv API: a whole batch of actions is sent and
+    a whole batch of results received per step. step_async only sends the actions, so the caller can work while
+    the server steps.
+
+    Returned arrays are views of the receive buffer: they stay valid until the next request (copy them if they have
+    to live longer).
+    """
+
+    def __init__(self, address: Address, num_envs: int, params: dict = None):
+        """
+        :param params: Overrides of the server's parameters (see: CLIENT_PARAMS).
+        """
+        self.connection = Connection(address)
+        description, observation_space, self.action_decoder = _make_session(self.connection, num_envs, params, True)
+        self.red_durations_raw = np.array(description["red_durations_raw"])
+        super().__init__(num_envs, observation_space, self.action_decoder.space)
+        self.reward_range = (0, float("inf"))
+        self._actions = None
+
+    def seed(self, seed=None) -> list:
+        """
+        Seeds every environment with its own seed: seed + index (or consecutive elements of a list of seeds).
+        """
+        seeds = env_seeds(seed, self.num_envs)
+        self.connection.request("seed", {"seeds": [int(s) for s in seeds]})
+        return seeds
+
+    def reset_async(self, seed=None, **kwargs):
+        if seed is not None:
+            self.seed(seed)
+        self.connection.send("reset")
+
+    def reset_wait(self, *args, **kwargs):
+        return self.connection.receive("reset")[1]["observation"]
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions, dtype=np.int64)
+        self.connection.send("step", arrays={"actions": self._actions})
+
+    def step_wait(self):
+        _, arrays = self.connection.receive("step")
+        dones = arrays["done"]
+        infos = step_infos(self.action_decoder, self.red_durations_raw, self._actions,
+                           {key: arrays[key] for key in INFO_FIELDS}, dones, arrays["terminal_observation"])
+        return arrays["observation"], arrays["reward"], dones, infos
+
+    def close_extras(self, **kwargs):
+        self.connection.close()
+
+
+class RemoteGraphTrafficEnv(gym.Env):
+    """
+    Single GraphTrafficEnv hosted by an EnvServer, with gym's Env API (see: RemoteVectorGraphTrafficEnv).
+    """
+
+    def __init__(self, address: Address, params: dict = None):
+        self.connection = Connection(address)
+        description, self.observation_space, self.action_decoder = _make_session(self.connection, 1, params, False)
+        self.red_durations_raw = np.array(description["red_durations_raw"])
+        self.action_space = self.action_decoder.space
+        self.reward_range = (0, float("inf"))
+
+    def seed(self, seed=None):
+        if seed is None:
+            seed = np.random.SeedSequence().entropy % (2 ** 31)
+        self.connection.request("seed", {"seeds": [int(seed)]})
+        return [seed]
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+        return self.connection.request("reset")[1]["observation"][0]
+
+    def step(self, action):
+        _, arrays = self.connection.request("step", arrays={"actions": np.asarray([action], dtype=np.int64)})
+        # the session does not reset the environment, so there is no terminal observation
+        info, = step_infos(self.action_decoder, self.red_durations_raw, [action],
+                           {key: arrays[key] for key in INFO_FIELDS}, np.zeros(1, dtype=bool), None)
+        return arrays["observation"][0], arrays["reward"][0], bool(arrays["done"][0]), info
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    from gym_graph_traffic.envs.params import PARAMETERS, PRESETS
+
+    parser = argparse.ArgumentParser(description="Server hosting GraphTrafficEnvs for remote clients.")
+    parser.add_argument("--preset", default=PARAMETERS["preset_name"], choices=list(PRESETS))
+    parser.add_argument("--engine", default=PARAMETERS["engine"])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--unix-socket", default=None, help="path of a Unix socket (instead of host and port)")
+    args = parser.parse_args()
+
+    params = {**PARAMETERS, **PRESETS[args.preset], "preset_name": args.preset, "engine": args.engine}
+    server = EnvServer(params, args.unix_socket or (args.host, args.port))
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+    main()
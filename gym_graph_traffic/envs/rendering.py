@@ -0,0 +1,158 @@
+"""
+Headless rendering: road network rasterized into a NumPy RGB frame buffer, and recording of frames to disk.
+
+Pixels of every cell, traffic light and road are computed once (same layout as the pygame renderer, see:
+Segment.draw and FourWayNoTurnsIntersection.draw), so drawing a frame is a copy of the background and two fancy
+index assignments, without any per-car draw calls.
+"""
+import numpy as np
+
+from gym_graph_traffic.envs.npy_format import npy_header_size, write_npy_header
+from gym_graph_traffic.envs.road_graph import DIRECTIONS, NO_PHASE, PHASES, RoadGraph
+
+RED = (253, 65, 30)
+
+
+class FrameRenderer:
+
+    def __init__(self, graph: RoadGraph, intersections, intersection_size: int, screen_size, scale_factor: int = 1,
+                 light_mode: bool = True):
+        """
+        :param intersections: List of (x, y) positions of intersections (see: util.grid).
+        :param screen_size: (width, height) of the frame before scaling.
+        """
+        self.width, self.height = screen_size
+        self.scale_factor = scale_factor
+        self.road_color = (192, 192, 192) if light_mode else (100, 100, 100)
+        self.car_color = (162, 162, 162) if light_mode else (180, 180, 180)
+        background_color = (244, 244, 244) if light_mode else (0, 0, 0)
+
+        # flat frame buffer with an extra pixel at the end, which collects all drawing outside of the frame
+        self._off_screen = self.width * self.height
+        self._buffer = np.empty((self._off_screen + 1, 3), dtype=np.uint8)
+        self.frame = self._buffer[:-1].reshape(self.height, self.width, 3)
+
+        size = intersection_size
+        half = size / 2
+        segment_rects = [_segment_rect(*intersections[i], size, DIRECTIONS[side], length)
+                         for length, i, side in zip(graph.lengths, graph.to_intersection, graph.to_side)]
+
+        # roads and intersections
+        self._background = np.empty_like(self._buffer)
+        self._background[:] = background_color
+        for x, y in intersections:
+            self._background[self._rect_pixels(x, y, size, size)] = self.road_color
+        for rect in segment_rects:
+            self._background[self._rect_pixels(*rect)] = self.road_color
+
+        # red lights: (intersection, phase) -> pixels (red for sides that are not in the phase)
+        self._light_pixels = np.array([[np.concatenate([self._rect_pixels(x, y, size, 1),
+                                                        self._rect_pixels(x, y + size - 1, size, 1)])
+                                        if phase == "lr" else
+                                        np.concatenate([self._rect_pixels(x, y, 1, size),
+                                                        self._rect_pixels(x + size - 1, y, 1, size)])
+                                        for phase in PHASES]
+                                       for x, y in intersections], dtype=np.int64)
+
+        # cell (in order of the engine's flat arrays) -> pixels of a car occupying it
+        cell_pixels = []
+        for (x, y, w, h), length, side in zip(segment_rects, graph.lengths, graph.to_side):
+            horizontal = h == half
+            for cx in range(length):
+                cx = cx if DIRECTIONS[side] in "lu" else (length - 1 - cx)
+                if horizontal:
+                    cell_pixels.append(self._rect_pixels(x + cx, y, 1, half))
+                else:
+                    cell_pixels.append(self._rect_pixels(x, y + cx, half, 1))
+        self._cell_pixels = np.array(cell_pixels, dtype=np.int64)
+
+    def _rect_pixels(self, x, y, w, h) -> np.ndarray:
+        """
+        :return: Flat indices of pixels of the rectangle (pixels outside of the frame point to the extra pixel).
+        """
+        xs = np.arange(int(x), int(x) + int(w))
+        ys = np.arange(int(y), int(y) + int(h))
+        xs, ys = np.meshgrid(xs, ys)
+        pixels = ys * self.width + xs
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        return np.where(inside, pixels, self._off_screen).reshape(-1)
+
+    def render(self, occupancy: np.ndarray, phase: np.ndarray) -> np.ndarray:
+        """
+        :param occupancy: Flat occupancy of all cells (1 if there is a car, 0 otherwise), see: engine.occupancy().
+        :param phase: Traffic light phase code of every intersection (no red lights for NO_PHASE).
+        :return: RGB frame of shape (height * scale_factor, width * scale_factor, 3). Unscaled frames are views
+                 of the renderer's buffer, overwritten by the next call.
+        """
+        self._buffer[:] = self._background
+        lit = np.flatnonzero(phase != NO_PHASE)
+        self._buffer[self._light_pixels[lit, phase[lit]]] = RED
+        self._buffer[self._cell_pixels[np.flatnonzero(occupancy)]] = self.car_color
+
+        if self.scale_factor == 1:
+            return self.frame
+        return self.frame.repeat(self.scale_factor, axis=0).repeat(self.scale_factor, axis=1)
+
+
+def _segment_rect(x, y, intersection_size, to_side, length):
+    """
+    :return: (x, y, w, h) of a segment entering the intersection at (x, y) (see: segment_draw_coords).
+    """
+    half = intersection_size / 2
+    return {"l": (x - length, y + half + 1, length, half),
+            "r": (x + intersection_size, y, length, half),
+            "d": (x + half + 1, y + intersection_size, half, length),
+            "u": (x, y - length, half, length)}[to_side]
+
+
+class FrameRecorder:
+    """
+    Streams frames to disk as they are recorded: to a .npy file of shape (num_frames, height, width, 3)
+    (header is rewritten with the final number of frames on close), or to a video through imageio
+    (any other extension, e.g. .mp4 or .gif).
+    """
+
+    def __init__(self, path: str, fps: int = 30):
+        self.path = str(path)
+        self.num_frames = 0
+        self._frame_shape = None
+
+        if self.path.endswith(".npy"):
+            self._file = open(self.path, "wb")
+            self._writer = None
+        else:
+            try:
+                import imageio
+            except ImportError:
+                raise ImportError("recording videos requires imageio (pip install imageio imageio-ffmpeg), "
+                                  "or use a .npy output file")
+            self._file = None
+            self._writer = imageio.get_writer(self.path, fps=fps)
+
+    def add(self, frame: np.ndarray) -> None:
+        if self._frame_shape is None:
+            self._frame_shape = frame.shape
+            if self._file is not None:
+                self._write_npy_header()
+        elif frame.shape != self._frame_shape:
+            raise ValueError(f"Frame of shape {frame.shape} does not match recorded frames {self._frame_shape}")
+
+        if self._file is not None:
+            self._file.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        else:
+            self._writer.append_data(frame)
+        self.num_frames += 1
+
+    def _write_npy_header(self) -> None:
+        write_npy_header(self._file, np.uint8, (self.num_frames, *self._frame_shape),
+                         npy_header_size(np.uint8, 1 + len(self._frame_shape)))
+
+    def close(self) -> None:
+        if self._file is not None:
+            if self._frame_shape is not None:
+                self._write_npy_header()
+            self._file.close()
+            self._file = None
+        elif self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,172 @@
+from functools import cached_property, lru_cache
+
+import numpy as np
+
+# sides of an intersection, a direction code is the index in this string
+DIRECTIONS = "udlr"
+
+# straight-through routing: entrance direction -> exit direction
+ROUTING = {"u": "d",
+           "d": "u",
+           "l": "r",
+           "r": "l"}
+
+# turning movements: entrance direction -> exit directions of left turn, straight through and right turn
+TURNS = {"u": "rdl",
+         "d": "lur",
+         "l": "urd",
+         "r": "dlu"}
+
+# traffic light phases, a phase code is the index in this tuple (cars coming from sides in the phase have green light)
+PHASES = ("ud", "lr")
+PHASE_CODES = {phase: code for code, phase in enumerate(PHASES)}
+NO_PHASE = len(PHASES)  # phase code of intersections that did not get any action yet
+
+# phase code, entrance direction code -> green light
+PHASE_GREEN = np.array([[d in phase for d in DIRECTIONS] for phase in PHASES], dtype=bool)
+
+
+def index_dtype(max_value: int) -> np.dtype:
+    """
+    :return: Smallest signed integer type holding values up to max_value, for arrays with an entry per cell
+             (e.g. segment of every cell, positions of cars), which dominate memory of large networks.
+    """
+    return np.min_scalar_type(-max(max_value, 0) - 1)
+
+
+class RoadGraph:
+    """
+    Road network compiled into integer index arrays, so that routing and green/red checks of all segments are
+    array gathers instead of dictionary lookups:
+
+    - segment -> intersection it enters (to_intersection) and side of that intersection (to_side, direction code),
+    - segment -> following segment (next_segment, -1 if there is none),
+    - intersection, direction code -> entering/exiting segment (entrances/exits, -1 if there is none),
+    - phase code, direction code -> green light (PHASE_GREEN).
+    """
+
+    def __init__(self, num_intersections: int, segments):
+        """
+        :param segments: List of (length, from_idx, from_side, to_idx, to_side) tuples (see: util.grid).
+        """
+        self.num_intersections = num_intersections
+        self.num_segments = len(segments)
+
+        (lengths, from_idx, from_side, to_idx, to_side) = zip(*segments)
+        self.lengths = np.array(lengths, dtype=np.int64)
+        self.from_intersection = np.array(from_idx, dtype=np.int64)
+        self.from_side = np.array([DIRECTIONS.index(d) for d in from_side], dtype=np.int64)
+        self.to_intersection = np.array(to_idx, dtype=np.int64)
+        self.to_side = np.array([DIRECTIONS.index(d) for d in to_side], dtype=np.int64)
+
+        # cells of segment i are offsets[i]:ends[i] in flat arrays of the whole network
+        self.ends = np.cumsum(self.lengths)
+        self.offsets = self.ends - self.lengths
+        self.num_cells = int(self.ends[-1])
+
+        segment_idx = np.arange(self.num_segments)
+        self.entrances = np.full((num_intersections, len(DIRECTIONS)), -1, dtype=np.int64)
+        self.entrances[self.to_intersection, self.to_side] = segment_idx
+        self.exits = np.full((num_intersections, len(DIRECTIONS)), -1, dtype=np.int64)
+        self.exits[self.from_intersection, self.from_side] = segment_idx
+
+        routing = np.array([DIRECTIONS.index(ROUTING[d]) for d in DIRECTIONS], dtype=np.int64)
+        self.next_segment = self.exits[self.to_intersection, routing[self.to_side]]
+        self.has_next_segment = self.next_segment >= 0
+
+        # segment -> exits of left turn, straight through and right turn (-1 if there is none)
+        turns = np.array([[DIRECTIONS.index(d) for d in TURNS[side]] for side in DIRECTIONS], dtype=np.int64)
+        self.turn_exits = self.exits[self.to_intersection[:, None], turns[self.to_side]]
+
+    @classmethod
+    def from_params(cls, params) -> "RoadGraph":
+        """
+        :return: Compiled road graph of the layout in params. Graphs are cached by layout, so environments of the same
+                 layout share a single (read-only) graph.
+        """
+        return _compile_road_graph(len(params["intersections"]), tuple(map(tuple, params["segments"])))
+
+    def green(self, phase: np.ndarray) -> np.ndarray:
+        """
+        :param phase: Phase code of every intersection.
+        :return: True for every segment whose cars can enter the following segment.
+        """
+        return PHASE_GREEN[phase[self.to_intersection], self.to_side] & self.has_next_segment
+
+    @cached_property
+    def next_hop(self) -> np.ndarray:
+        """
+        Shortest routes (by length in cells) between all intersections, computed once per road graph: all
+        destinations are relaxed together (Bellman-Ford over the segments), so this costs O(num_intersections ** 2)
+        memory.
+
+        :return: Array of shape (num_intersections, num_intersections): exit segment of the first intersection on
+                 the shortest route to the second one (-1 for the intersection itself and unreachable ones).
+        """
+        num_intersections = self.num_intersections
+        distance = np.full((num_intersections, num_intersections), np.inf)
+        np.fill_diagonal(distance, 0)
+        for _ in range(num_intersections):
+            relaxed = distance.copy()
+            np.minimum.at(relaxed, self.from_intersection, self.lengths[:, None] + distance[self.to_intersection])
+            if np.array_equal(relaxed, distance):
+                break
+            distance = relaxed
+
+        # exit of the shortest route (the first direction wins ties)
+        best = np.full_like(distance, np.inf)
+        next_hop = np.full(distance.shape, -1, dtype=np.int64)
+        for exits in self.exits.T:
+            via = self.lengths[exits][:, None] + distance[self.to_intersection[exits]]
+            via[exits < 0] = np.inf
+            shorter = via < best
+            best[shorter] = via[shorter]
+            next_hop[shorter] = np.broadcast_to(exits[:, None], shorter.shape)[shorter]
+        np.fill_diagonal(next_hop, -1)
+        next_hop.setflags(write=False)
+        return next_hop
+
+    def wrap_segments(self, positions) -> np.ndarray:
+        """
+        Segments that wrap around the network (e.g. the ones closing rows and columns of util.grid layouts into
+        loops): the intersection they enter is not on the side of the intersection they leave.
+
+        :param positions: (x, y) position of every intersection.
+        :return: Indices of the segments.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(self.num_intersections, 2)
+        delta = positions[self.to_intersection] - positions[self.from_intersection]
+        # exit direction code -> axis and sign of the position of the following intersection
+        axis = np.array([1, 1, 0, 0])[self.from_side]
+        sign = np.array([-1, 1, -1, 1])[self.from_side]
+        return np.flatnonzero(delta[np.arange(self.num_segments), axis] * sign <= 0)
+
+    def spatial_partitions(self, positions, num_partitions: int) -> np.ndarray:
+        """
+        Cuts the network into strips across its longer side, with similar numbers of cells. Every segment belongs to
+        the partition of the intersection it enters, so only cars crossing intersections at the borders of strips
+        move between partitions.
+
+        :param positions: (x, y) position of every intersection.
+        :return: Partition of every segment.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(self.num_intersections, 2)
+        axis = int(np.ptp(positions[:, 1]) > np.ptp(positions[:, 0]))
+        order = np.lexsort((positions[:, 1 - axis], positions[:, axis]))
+
+        # cells entering every intersection, partition of an intersection by the cells before it (in strip order)
+        cells = np.bincount(self.to_intersection, weights=self.lengths,
+                            minlength=self.num_intersections).astype(np.int64)[order]
+        cells_before = np.cumsum(cells) - cells
+        partition = np.empty(self.num_intersections, dtype=np.int64)
+        partition[order] = np.minimum(cells_before * num_partitions // max(self.num_cells, 1), num_partitions - 1)
+        return partition[self.to_intersection]
+
+
+@lru_cache(maxsize=64)
+def _compile_road_graph(num_intersections: int, segments: tuple) -> RoadGraph:
+    graph = RoadGraph(num_intersections, segments)
+    for value in vars(graph).values():
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+    return graph
@@ -0,0 +1,234 @@
+"""
+Turning movements and origin-destination routing of cars (see: ROUTES in params.py).
+
+Every car carries a route value chosen when it enters a segment, which determines the following segment it turns
+into at the end of the segment:
+
+- "turns" - the value is the following segment itself, drawn from turning probabilities (left, straight, right) of
+  the entrance the segment leads to,
+- "od" - the value is the destination intersection of the car, the following segment is the next hop of the shortest
+  route to it (RoadGraph.next_hop). A car entering the last segment of its route draws a new destination, so the
+  number of cars stays constant.
+
+Cars never overtake on a segment, so route values are kept in a ring buffer per segment (in the order of cars, the
+first one is the car closest to the end) with a slot per cell of the segment. Only the first car of a segment can
+cross an intersection during an update, so choosing its route is an array lookup, and the engines' kernels do not
+need to move route values together with cars.
+
+Turns let several entrances lead into the same exit during an update, only one of them has the right of way (see:
+CarRoutes.right_of_way), the others have red light for the update.
+"""
+import numpy as np
+
+from gym_graph_traffic.envs.road_graph import RoadGraph, index_dtype
+
+ROUTES = ("turns", "od")
+
+# right of way of movements (left turn, straight through, right turn) into the same exit, the lowest one goes first
+MOVEMENT_PRIORITY = np.array([2, 0, 1], dtype=np.int64)
+
+
+class TurnRoutes:
+    """
+    Route values are following segments, drawn from turning probabilities of every segment's entrance.
+    """
+
+    def __init__(self, graph: RoadGraph, turn_probabilities):
+        """
+        :param turn_probabilities: Probabilities of left turn, straight through and right turn, of all entrances
+                                   or of every segment (shape (num_segments, 3)); missing exits are left out and the
+                                   rest is normalized.
+        """
+        probabilities = np.broadcast_to(np.asarray(turn_probabilities, dtype=np.float64), (graph.num_segments, 3))
+        cumulative = np.cumsum(np.where(graph.turn_exits >= 0, probabilities, 0), axis=1)
+        total = cumulative[:, -1:]
+        self.choices = np.where(total > 0, graph.turn_exits, -1)
+        # exactly 1 from the last possible exit on, so a draw in [0, 1) never picks a missing one
+        self.cdf = np.where(cumulative >= total, 1.0, cumulative / np.where(total > 0, total, 1))
+
+    def assign(self, segment: np.ndarray, previous: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """
+        :param segment: Segments the cars enter.
+        :param previous: Route values of the cars (None for new cars).
+        :return: Route values of the cars on the segments.
+        """
+        choice = np.sum(rng.random(segment.size)[:, None] >= self.cdf[segment], axis=1)
+        return self.choices[segment, choice]
+
+    def next_segment(self, segment: np.ndarray, value: np.ndarray) -> np.ndarray:
+        return value
+
+
+class ODRoutes:
+    """
+    Route values are destination intersections, following segments are next hops of shortest routes.
+    """
+
+    def __init__(self, graph: RoadGraph):
+        self.to_intersection = graph.to_intersection
+        self.next_hop = graph.next_hop
+
+        # intersections reachable from every intersection (other than itself), as lists in a single array
+        reachable = self.next_hop >= 0
+        self.num_reachable = reachable.sum(axis=1)
+        self.reachable_offsets = np.cumsum(self.num_reachable) - self.num_reachable
+        self.reachable = np.nonzero(reachable)[1]
+
+    def assign(self, segment: np.ndarray, previous: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """
+        :return: Destinations of the cars (previous ones, or new ones for new cars and cars that reach their
+                 destination at the end of the segment, -1 if no intersection is reachable).
+        """
+        intersection = self.to_intersection[segment]
+        value = np.array(intersection if previous is None else previous, dtype=np.int64)
+        arrived = np.flatnonzero(value == intersection)
+        intersection = intersection[arrived]
+        num_reachable = self.num_reachable[intersection]
+        choice = (rng.random(arrived.size) * num_reachable).astype(np.int64)
+        value[arrived] = np.where(num_reachable > 0, self.reachable[self.reachable_offsets[intersection] + choice], -1)
+        return value
+
+    def next_segment(self, segment: np.ndarray, value: np.ndarray) -> np.ndarray:
+        return np.where(value >= 0, self.next_hop[self.to_intersection[segment], value], -1)
+
+
+def make_routes(graph: RoadGraph, params):
+    """
+    :return: Route tables of params (None for straight-through routing).
+    """
+    routes = params.get("routes")
+    if routes is None:
+        return None
+    if routes == "turns":
+        return TurnRoutes(graph, params.get("turn_probabilities", (0.2, 0.6, 0.2)))
+    if routes == "od":
+        return ODRoutes(graph)
+    raise ValueError(f"Unknown routes: {routes} (available: {', '.join(ROUTES)})")
+
+
+class CarRoutes:
+    """
+    Route values of all cars of num_copies copies of a road network, in ring buffers of every segment (segment i of
+    copy c has index c * num_segments + i and cells offsets[i]:ends[i] of the flat arrays, as in VectorizedEngine).
+    """
+
+    def __init__(self, graph: RoadGraph, routes, num_copies: int, rng: np.random.Generator):
+        self.routes = routes
+        self.num_segments = graph.num_segments
+        self.rng = rng
+
+        self.lengths = np.tile(graph.lengths, num_copies)
+        self.ends = np.cumsum(self.lengths)
+        self.offsets = self.ends - self.lengths
+        self.segment_of_cell = np.repeat(np.arange(self.lengths.size, dtype=index_dtype(self.lengths.size)),
+                                         self.lengths)
+        self._copy_offset = np.repeat(np.arange(num_copies) * self.num_segments, self.num_segments)
+        self._local_segment = np.tile(np.arange(self.num_segments), num_copies)
+        turn_exits = np.tile(graph.turn_exits, (num_copies, 1))
+        self._turn_exits = np.where(turn_exits >= 0, turn_exits + self._copy_offset[:, None], -1)
+
+        # dynamic state: route values and the first car and number of cars of every ring (see: get_state)
+        value_dtype = np.int16 if max(graph.num_segments, graph.num_intersections) <= np.iinfo(np.int16).max \
+            else np.int32
+        self.state_dtype = np.dtype([("value", value_dtype, (int(self.ends[-1]),)),
+                                     ("head", np.int64, (self.lengths.size,)),
+                                     ("count", np.int64, (self.lengths.size,))])
+        self.bind(np.zeros((), dtype=self.state_dtype))
+
+    def bind(self, state: np.ndarray) -> None:
+        """
+        Keeps the state in given buffer of state_dtype (e.g. a field of the engine's state).
+        """
+        self.state = state
+        self.value = state["value"]
+        self.head = state["head"]
+        self.count = state["count"]
+
+    def get_state(self, state: np.ndarray) -> None:
+        state[...] = self.state
+
+    def set_state(self, state: np.ndarray) -> None:
+        self.state[...] = state
+
+    def reset(self, occupancy: np.ndarray) -> None:
+        """
+        Draws routes of all cars (in order of cells).
+
+        :param occupancy: Flat array of all cells of all copies, 1 for every cell occupied by a car.
+        """
+        cars = np.flatnonzero(occupancy)
+        segment = self.segment_of_cell[cars]
+        self.count[:] = np.bincount(segment, minlength=self.count.size)
+        self.head[:] = 0
+
+        # the car closest to the end of a segment is the first one of its ring
+        rank = (np.cumsum(self.count) - 1)[segment] - np.arange(cars.size)
+        value = self.routes.assign(self._local_segment[segment], None, self.rng)
+        self.value[self.offsets[segment] + rank] = value
+
+    def next_segment(self, out: np.ndarray) -> None:
+        """
+        :param out: Following segment of the first car of every segment (-1 if there is no car or no route).
+        """
+        has_cars = self.count > 0
+        value = self.value[self.offsets + self.head].astype(np.int64)
+        local = self.routes.next_segment(self._local_segment, value)
+        out[:] = np.where(has_cars & (local >= 0), local + self._copy_offset, -1)
+
+    def right_of_way(self, green: np.ndarray, next_segment: np.ndarray) -> np.ndarray:
+        """
+        :param green: Segments whose first cars have green light into their following segments.
+        :param next_segment: Following segment of every segment (see: next_segment).
+        :return: Green segments that have the right of way: of the ones leading into the same following segment,
+                 the one with the lowest movement priority (MOVEMENT_PRIORITY), then the lowest index.
+        """
+        source = np.flatnonzero(green)
+        target = next_segment[source]
+        movement = np.argmax(self._turn_exits[source] == target[:, None], axis=1)
+        key = MOVEMENT_PRIORITY[movement] * green.size + source
+        first = np.full(green.size, np.iinfo(np.int64).max)
+        np.minimum.at(first, target, key)
+        out = np.zeros_like(green)
+        out[source] = first[target] == key
+        return out
+
+    def exchange(self, source: np.ndarray, landing_cell: np.ndarray) -> None:
+        """
+        Moves route values of cars that crossed intersections during an update.
+
+        :param source: Segments the cars left (each one at most once, in increasing order).
+        :param landing_cell: Cells the cars entered (negative for cars that left the network, see: boundary).
+        """
+        if source.size == 0:
+            return
+        value = self.value[self.offsets[source] + self.head[source]].astype(np.int64)
+        self.head[source] = (self.head[source] + 1) % self.lengths[source]
+        self.count[source] -= 1
+
+        staying = landing_cell >= 0
+        if not staying.all():
+            value = value[staying]
+            landing_cell = landing_cell[staying]
+        segment = self.segment_of_cell[landing_cell]
+        self._push(landing_cell, self.routes.assign(self._local_segment[segment], value, self.rng))
+
+    def enter(self, cell: np.ndarray) -> None:
+        """
+        Draws routes of new cars (see: boundary) entering given cells (of distinct segments).
+        """
+        segment = self.segment_of_cell[cell]
+        self._push(cell, self.routes.assign(self._local_segment[segment], None, self.rng))
+
+    def _push(self, landing_cell: np.ndarray, value: np.ndarray) -> None:
+        """
+        Cars enter rings behind the cars on their segments (cars landing further enter first).
+        """
+        segment = self.segment_of_cell[landing_cell]
+        order = np.lexsort((-landing_cell, segment))
+        segment = segment[order]
+        first = np.ones(segment.size, dtype=bool)
+        first[1:] = segment[1:] != segment[:-1]
+        rank = np.arange(segment.size) - np.maximum.accumulate(np.where(first, np.arange(segment.size), 0))
+        position = (self.head[segment] + self.count[segment] + rank) % self.lengths[segment]
+        self.value[self.offsets[segment] + position] = value[order]
+        np.add.at(self.count, segment, 1)
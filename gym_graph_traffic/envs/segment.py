@@ -1,18 +1,26 @@
-from typing import Union, Tuple
+from typing import Tuple
 
 import numpy as np
-import pygame
 
 from gym_graph_traffic.envs.intersection import Intersection
+from gym_graph_traffic.envs.road_graph import index_dtype
 
 
 class Segment:
+    # large networks have tens of thousands of segments: no per-instance dictionaries
+    __slots__ = ("idx", "rng", "length", "next_intersection", "car_density", "max_v", "prob_slow_down", "_cells",
+                 "_x", "_v", "_free_cells", "_start", "car_count", "p", "free_init_cells", "num_crossing", "metrics",
+                 "to_side")
 
     def __init__(self, idx: int, length: int, next_intersection: Intersection, to_side, car_density: float,
-                 max_v: int, prob_slow_down: float, intersection_size: int, **kwargs):
+                 max_v: int, prob_slow_down: float, intersection_size: int, rng: np.random.Generator = None,
+                 **kwargs):
 
         self.idx = idx
 
+        # random number generator (shared with the whole environment)
+        self.rng = rng if rng is not None else np.random.default_rng()
+
         # graph info
         self.length = length
         self.next_intersection = next_intersection
@@ -22,18 +30,32 @@ class Segment:
         self.max_v = max_v
         self.prob_slow_down = prob_slow_down
 
+        # preallocated buffers, no array is allocated during an update:
+        # - cells of the segment followed by max_v cells it can be extended by (free cells of the following segment),
+        # - positions and velocities of cars (in order of positions) at indices start:start + car_count of buffers
+        #   twice as long as the segment: cars leave from the end and enter at the beginning of that range,
+        #   which is moved back to the end of the buffers when there is no room left before it
+        # positions never exceed length + max_v, so they are kept in the smallest type that holds them
+        self._cells = np.zeros(length + max_v, dtype=np.int8)
+        self._x = np.zeros(2 * length, dtype=index_dtype(length + max_v))
+        self._v = np.zeros(2 * length, dtype=np.int8)
+        self._free_cells = np.zeros(length, dtype=self._x.dtype)
+        self._start = 2 * length
+        self.car_count = 0
+
         # cars positions and velocities
-        self.p: Union[None, np.ndarray] = None  # position vector: 1 if there is a car, 0 otherwise
-        self.v: Union[None, np.ndarray] = None  # velocity vector (of length equal to current number of cars on segment)
+        self.p: np.ndarray = self._cells[:length]  # position vector: 1 if there is a car, 0 otherwise
 
-        # communication with neighbour segments about cars that cross intersections
+        # communication with neighbour segments about cars that cross intersections (see: SegmentEngine.exchange):
+        # free init cells of the segment, and number of cars that moved past its end during last update
         self.free_init_cells: int = 0
-        self.new_car_at: Union[None, Tuple[int, int]] = None
+        self.num_crossing: int = 0
 
-        self.to_side = to_side
+        # metrics after last update: total distance covered by cars and number of cars (may be a view of an array
+        # shared by all segments, see: SegmentEngine)
+        self.metrics: np.ndarray = np.zeros(2, dtype=np.int64)
 
-        # render
-        self.road_width = intersection_size / 2
+        self.to_side = to_side
 
         # initialize cars and free init cells
         self.reset()
@@ -41,28 +63,68 @@ class Segment:
     def __str__(self) -> str:
         return str(self.idx)
 
+    @property
+    def v(self) -> np.ndarray:
+        """
+        Velocity vector (of length equal to current number of cars on segment).
+        """
+        return self._v[self._start:self._start + self.car_count]
+
     def reset(self) -> None:
-        self.p = np.random.binomial(1, self.car_density, self.length)
-        self.v = np.zeros(self.p.nonzero()[0].shape, dtype=np.int8)
+        self._cells[:self.length] = self.rng.binomial(1, self.car_density, self.length)
+        self._set_cars(0)
+
+    def set_cells(self, p: np.ndarray, v: np.ndarray) -> None:
+        """
+        Sets cars of the segment.
+
+        :param p: Position vector (1 if there is a car, 0 otherwise).
+        :param v: Velocity of the car occupying every cell (ignored for free cells).
+        """
+        self._cells[:self.length] = p
+        self._set_cars(np.asarray(v)[self.p == 1])
+
+    def _set_cars(self, v) -> None:
+        """
+        Fills car buffers from the position vector.
+
+        :param v: Velocities of cars (in order of positions).
+        """
+        self._cells[self.length:] = 0
+        self.num_crossing = 0
+        cars = np.flatnonzero(self.p)
+        self.car_count = cars.size
+        self._start = self._x.size - cars.size
+        self._x[self._start:] = cars
+        self._v[self._start:] = v
         self._update_free_init_cells()
+        self._update_metrics()
+
+    def buffers(self) -> Tuple[np.ndarray, ...]:
+        """
+        :return: Arrays holding cars of the segment.
+        """
+        return self._cells, self._x, self._v
 
     def draw(self, surface, light_mode):
-        pass
+        import pygame
+
+        road_width = self.next_intersection.intersection_size / 2
         (x, y, w, h) = self.next_intersection.segment_draw_coords(self.length, self.to_side)
         road_color = (192, 192, 192) if light_mode else (100, 100, 100)
         pygame.draw.rect(surface, road_color,
                          pygame.Rect(x, y, w, h))
 
-        dy = w == self.road_width
-        dx = h == self.road_width
+        dy = w == road_width
+        dx = h == road_width
 
         for cx in np.nonzero(self.p)[0]:
             cx = cx if self.to_side in "lu" else (self.length - 1 - cx)
             car_color = (162, 162, 162) if light_mode else (180, 180, 180)
 
             pygame.draw.rect(surface, car_color,
-                             pygame.Rect((cx * dx + x), (cx * dy + y), self.road_width if dy else 1,
-                                         self.road_width if dx else 1))
+                             pygame.Rect((cx * dx + x), (cx * dy + y), road_width if dy else 1,
+                                         road_width if dx else 1))
 
     def total_distance(self) -> int:
         """
@@ -86,77 +148,132 @@ class Segment:
         """
         :return: Number of cars present at segment after last update.
         """
-        return self.v.size
+        return self.car_count
 
-    def update_first_phase(self) -> None:
+    def update_first_phase(self, slow_down: np.ndarray = None, next_segment_free_cells: int = None) -> int:
         """
-        First phase of segment update: cellular automata step, and (sometimes) passing car to following segment.
+        First phase of segment update: cellular automata step. Cars that moved past the end of the segment stay at
+        the end of car buffers until they are taken by pop_crossing_cars (see: SegmentEngine.exchange).
+
+        :param slow_down: Random slow downs of cars on the segment (drawn by the segment if not given).
+        :param next_segment_free_cells: Free cells of the following segment the cars can enter
+                                        (asked from the next intersection if not given).
+        :return: Number of cars that crossed the intersection.
         """
 
-        # extend p vector by free cells of following segment
-        next_segment_free_cells = self.next_intersection.can_i_go(self.idx)
-        if next_segment_free_cells > 0:
-            self.p = np.append(self.p, np.zeros(next_segment_free_cells))
+        if next_segment_free_cells is None:
+            next_segment_free_cells = self.next_intersection.can_i_go(self.idx)
 
-        # update cellular automata
-        self._nagel_schreckenberg_step()
+        # update cellular automata (the last cars can move up to next_segment_free_cells cells past the segment)
+        if slow_down is None:
+            slow_down = self.rng.binomial(1, self.prob_slow_down, self.car_count)
+        self._nagel_schreckenberg_step(slow_down, next_segment_free_cells)
 
-        # cut excessive cells
-        self.p, next_segment_cells = np.split(self.p, [self.length])
+        # cars past the end of the segment (by the rules of automata only the last one, but the exchange does not
+        # depend on it)
+        end = self._start + self.car_count
+        num_crossing = 0
+        while num_crossing < self.car_count and self._x[end - num_crossing - 1] >= self.length:
+            num_crossing += 1
+        self.num_crossing = num_crossing
+        return num_crossing
 
-        # if some car crossed intersection: pass car to next segment (via the intersection)
-        try:
-            next_sect_car_pos = next_segment_cells.tolist().index(1)
-            # at any given update, only one car can cross intersection (by the rules of automata)
-            self.v, next_sect_car_vel = np.split(self.v, [-1])
-            self.next_intersection.pass_car(self.idx, next_sect_car_pos, next_sect_car_vel[0])
-        except:
-            pass
+    def pop_crossing_cars(self, positions: np.ndarray, velocities: np.ndarray) -> int:
+        """
+        Removes cars that crossed the intersection during last update from the segment.
 
-    def update_second_phase(self) -> None:
+        :param positions: Output array, positions of the cars in the following segment (in order of positions).
+        :param velocities: Output array, velocities of the cars.
+        :return: Number of cars written to the output arrays.
         """
-        Second phase of segment update: receiving car from preceding segment and updating info about init cells.
+        n = self.num_crossing
+        if n > 0:
+            end = self._start + self.car_count
+            x = self._x[end - n:end]
+            self._cells[x] = 0
+            np.subtract(x, self.length, out=positions[:n])
+            velocities[:n] = self._v[end - n:end]
+            self.car_count -= n
+            self.num_crossing = 0
+        return n
+
+    def receive_cars(self, positions: np.ndarray, velocities: np.ndarray) -> None:
         """
+        Cars entering the segment from preceding segments (they are behind all cars of the segment).
 
-        # receive car from preceding segment (if there is any)
-        if self.new_car_at is not None:
-            (pos, vel) = self.new_car_at
-            self.p[pos] = 1
-            self.v = np.insert(self.v, 0, vel)
-            self.new_car_at = None
+        :param positions: Positions of the cars (in order of positions, distinct).
+        :param velocities: Velocities of the cars.
+        """
+        n = positions.size
+        if self._start < n:
+            self._move_cars_to_end()
+        self._start -= n
+        self._x[self._start:self._start + n] = positions
+        self._v[self._start:self._start + n] = velocities
+        self._cells[positions] = 1
+        self.car_count += n
 
-        # update information about init cells
+    def update_second_phase(self) -> None:
+        """
+        Second phase of segment update (after cars crossing intersections were received): updating info about
+        init cells and metrics.
+        """
         self._update_free_init_cells()
+        self._update_metrics()
 
-    def _nagel_schreckenberg_step(self) -> None:
+    def _nagel_schreckenberg_step(self, slow_down: np.ndarray, extension: int) -> None:
         """
-        Updating automata by the rules of Nagel-Schreckenberg model.
+        Updating automata by the rules of Nagel-Schreckenberg model (in place).
+
+        :param slow_down: 1 for every car that randomly slows down, 0 otherwise.
+        :param extension: Number of free cells of the following segment the last car can move to.
         """
+        if self.car_count == 0:
+            return
+        x = self._x[self._start:self._start + self.car_count]
+        v = self._v[self._start:self._start + self.car_count]
+        free_cells = self._free_cells[:self.car_count]
 
         # 1. Acceleration
-        self.v += 1
-        self.v[self.v == self.max_v + 1] = self.max_v
+        v += 1
+        np.minimum(v, self.max_v, out=v)
 
         # 2. Slowing down
-        cars_indices = self.p.nonzero()[0]
-        cars_indices_extended = np.append(cars_indices, self.p.size)
-        free_cells = cars_indices_extended[1:] - cars_indices - 1
-        self.v = np.minimum(self.v, free_cells)
+        np.subtract(x[1:], x[:-1], out=free_cells[:-1])
+        free_cells[-1] = self.length + extension - x[-1]
+        free_cells -= 1
+        np.minimum(v, free_cells, out=v)
 
         # 3. Randomization
-        self.v -= np.random.binomial(1, self.prob_slow_down, self.v.size)
-        self.v[self.v == -1] = 0
+        np.subtract(v, slow_down, out=v)
+        np.maximum(v, 0, out=v)
 
         # 4. Car motion
-        new_cars_indices = cars_indices + self.v
-        self.p = np.zeros_like(self.p)
-        self.p.put(new_cars_indices, 1)
+        self._cells[x] = 0
+        x += v
+        self._cells[x] = 1
+
+    def _move_cars_to_end(self) -> None:
+        """
+        Moves cars to the end of car buffers, to make room for cars entering the segment.
+        """
+        start = self._x.size - self.car_count
+        self._x[start:] = self._x[self._start:self._start + self.car_count]
+        self._v[start:] = self._v[self._start:self._start + self.car_count]
+        self._start = start
 
     def _update_free_init_cells(self) -> None:
         """
         Updating information about init cells.
         """
-        i = 0
-        while i < self.max_v and self.p[i] != 1:
-            i += 1
-        self.free_init_cells = i
+        if self.car_count == 0:
+            self.free_init_cells = self.max_v
+        else:
+            self.free_init_cells = min(int(self._x[self._start]), self.max_v)
+
+    def _update_metrics(self) -> None:
+        """
+        Updating metrics of the segment (total distance and number of cars).
+        """
+        self.metrics[0] = self.total_distance()
+        self.metrics[1] = self.num_cars()
@@ -0,0 +1,193 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Dict, Tuple
+
+import gym
+import numpy as np
+
+from gym_graph_traffic.envs.actions import ActionDecoder
+from gym_graph_traffic.envs.graph_traffic import GraphTrafficEnv
+from gym_graph_traffic.envs.vector_graph_traffic import INFO_FIELDS, env_seeds, step_infos
+
+
+def _buffer_layout(buffer_size: int, num_envs: int, num_segments: int) -> Dict[str, Tuple[tuple, np.dtype]]:
+    """
+    :return: Fields of the ring buffer: name -> (shape, dtype). First axis is the slot, second the worker.
+    """
+    return {"observation": ((buffer_size, num_envs, 2, num_segments), np.float32),
+            "terminal_observation": ((buffer_size, num_envs, 2, num_segments), np.float32),
+            "reward": ((buffer_size, num_envs), np.float32),
+            "done": ((buffer_size, num_envs), np.bool_),
+            **{key: ((buffer_size, num_envs), np.float32) for key in INFO_FIELDS}}
+
+
+def _buffer_views(buffer, layout) -> Dict[str, np.ndarray]:
+    views = {}
+    offset = 0
+    for name, (shape, dtype) in layout.items():
+        views[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+        offset += -(-views[name].nbytes // 8) * 8  # keep every field 8-byte aligned
+    return views
+
+
+def _buffer_nbytes(layout) -> int:
+    return sum(-(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 8) * 8 for shape, dtype in layout.values())
+
+
+def _worker(index, params, pipe, parent_pipe, shm_name, layout) -> None:
+    parent_pipe.close()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buffers = _buffer_views(shm.buf, layout)
+    env = None
+    try:
+        env = GraphTrafficEnv(params)
+        pipe.send((True, (env.observation_space, env.action_space)))
+
+        while True:
+            command, slot, data = pipe.recv()
+
+            if command == "step":
+                observation, reward, done, info = env.step(data)
+                if done:
+                    buffers["terminal_observation"][slot, index] = observation
+                    observation = env.reset()
+                buffers["observation"][slot, index] = observation
+                buffers["reward"][slot, index] = reward
+                buffers["done"][slot, index] = done
+                for key in INFO_FIELDS:
+                    buffers[key][slot, index] = info[key]
+            elif command == "reset":
+                buffers["observation"][slot, index] = env.reset()
+            elif command == "seed":
+                env.seed(data)
+            elif command == "close":
+                pipe.send((True, None))
+                break
+            else:
+                raise ValueError(f"Unknown command: {command}")
+
+            pipe.send((True, None))
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except Exception as e:
+        pipe.send((False, e))
+    finally:
+        del buffers
+        shm.close()
+        if env is not None:
+            env.close()
+
+
+class SharedMemoryVectorGraphTrafficEnv(gym.vector.VectorEnv):
+    """
+    num_envs GraphTrafficEnvs, each stepped in its own worker process. Workers write observations, rewards, dones
+    and info fields straight into a ring buffer in shared memory; the parent only sends them actions (integers), so
+    nothing but tiny control messages is pickled per step.
+
+    Returned arrays are views of the ring buffer: they stay valid for buffer_size - 1 following steps
+    (copy them if they have to live longer).
+    """
+
+    def __init__(self, params, num_envs: int, buffer_size: int = 2, context: str = None):
+        self.params = dict(params)
+        self.num_intersections = len(params["intersections"])
+        self.num_segments = len(params["segments"])
+        self.red_durations_raw = np.array(params["red_durations_raw"])
+        self.action_decoder = ActionDecoder(self.params.get("action_mode", "discrete"),
+                                            len(params["red_durations"]), self.num_intersections)
+
+        # ring buffer in shared memory
+        self.buffer_size = buffer_size
+        self.slot = 0
+        self._layout = _buffer_layout(buffer_size, num_envs, self.num_segments)
+        self._shm = shared_memory.SharedMemory(create=True, size=_buffer_nbytes(self._layout))
+        self._buffers = _buffer_views(self._shm.buf, self._layout)
+
+        # workers
+        ctx = mp.get_context(context)
+        self.parent_pipes = []
+        self.processes = []
+        for index in range(num_envs):
+            # every worker gets its own seed (if any)
+            worker_params = self.params
+            if self.params.get("seed") is not None:
+                worker_params = {**self.params, "seed": self.params["seed"] + index}
+
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(target=_worker, daemon=True,
+                                  args=(index, worker_params, child_pipe, parent_pipe, self._shm.name, self._layout))
+            process.start()
+            child_pipe.close()
+            self.parent_pipes.append(parent_pipe)
+            self.processes.append(process)
+
+        observation_space, action_space = self._receive()[0]
+        super().__init__(num_envs, observation_space, action_space)
+        self.reward_range = (0, float("inf"))
+        self._actions = None
+
+    def _send(self, command, data=None) -> None:
+        for i, pipe in enumerate(self.parent_pipes):
+            pipe.send((command, self.slot, data[i] if data is not None else None))
+
+    def _receive(self) -> list:
+        results = [pipe.recv() for pipe in self.parent_pipes]
+        for success, result in results:
+            if not success:
+                raise result
+        return [result for _, result in results]
+
+    def _next_slot(self) -> None:
+        self.slot = (self.slot + 1) % self.buffer_size
+
+    def seed(self, seed=None) -> list:
+        """
+        Seeds every worker with its own seed: seed + worker index (or consecutive elements of a list of seeds).
+        """
+        seeds = env_seeds(seed, self.num_envs)
+        self._send("seed", seeds)
+        self._receive()
+        return seeds
+
+    def reset_async(self, seed=None, **kwargs):
+        if seed is not None:
+            self.seed(seed)
+        self._next_slot()
+        self._send("reset")
+
+    def reset_wait(self, *args, **kwargs):
+        self._receive()
+        return self._buffers["observation"][self.slot]
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions, dtype=np.int64)
+        self._next_slot()
+        self._send("step", list(self._actions))
+
+    def step_wait(self):
+        self._receive()
+
+        slot = self.slot
+        dones = self._buffers["done"][slot]
+        infos = step_infos(self.action_decoder, self.red_durations_raw, self._actions,
+                           {key: self._buffers[key][slot] for key in INFO_FIELDS},
+                           dones, self._buffers["terminal_observation"][slot])
+
+        return self._buffers["observation"][slot], self._buffers["reward"][slot], dones, infos
+
+    def close_extras(self, timeout=None, terminate=False):
+        for pipe, process in zip(self.parent_pipes, self.processes):
+            if process.is_alive():
+                try:
+                    pipe.send(("close", self.slot, None))
+                    pipe.recv()
+                except (BrokenPipeError, EOFError):
+                    pass
+            pipe.close()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        del self._buffers
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,155 @@
+"""
+Traffic lights of all intersections as arrays: applying actions and advancing countdowns are single vectorized
+operations, whatever the number of intersections (and of copies of the road network). Engines turn phase codes into
+green masks with the PHASE_GREEN table (see: RoadGraph.green), so new phases (e.g. all-red, turns) are new rows of
+PHASES and PHASE_GREEN.
+
+An action of an intersection selects a signal plan: a sequence of stages, every stage is a phase code (see:
+road_graph.PHASES) lasting a number of updates. After its last stage a plan starts over (a cycle), unless the stage
+is held (HOLD) until the next action. Stages lasting 0 updates are skipped. The default plans (see: red_duration_plans)
+are those of FourWayNoTurnsIntersection: "ud" for the red duration of the action, then "lr" until the next action.
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from gym_graph_traffic.envs.road_graph import NO_PHASE, PHASE_CODES, PHASES
+
+# duration of a stage that lasts until the next action
+HOLD = -1
+
+Stage = Tuple[int, int]
+
+
+class SignalPlans:
+    """
+    Signal plans compiled into tables: plan, stage -> phase code (stage_phase) and duration in updates
+    (stage_updates, HOLD for held stages), padded to the longest plan.
+    """
+
+    def __init__(self, plans: Sequence[Sequence[Stage]]):
+        """
+        :param plans: Stages of every plan, as (phase code, duration in updates or HOLD) tuples.
+        """
+        self.num_plans = len(plans)
+        self.max_stages = max(len(plan) for plan in plans)
+        self.num_stages = np.array([len(plan) for plan in plans], dtype=np.int64)
+        self.stage_phase = np.full((self.num_plans, self.max_stages), NO_PHASE, dtype=np.int64)
+        self.stage_updates = np.zeros((self.num_plans, self.max_stages), dtype=np.int64)
+        for i, plan in enumerate(plans):
+            if all(updates == 0 for _, updates in plan):
+                raise ValueError(f"Signal plan {i} has no stage lasting at least one update")
+            for j, (phase, updates) in enumerate(plan):
+                if not 0 <= phase < len(PHASES):
+                    raise ValueError(f"Signal plan {i} has unknown phase code {phase}")
+                self.stage_phase[i, j] = phase
+                self.stage_updates[i, j] = updates
+
+
+def red_duration_plans(red_durations: List[int]) -> SignalPlans:
+    """
+    :param red_durations: Red duration (of "lr" entrances) in updates of every action.
+    :return: Plans "ud" for the red duration, then "lr" until the next action (see: FourWayNoTurnsIntersection).
+    """
+    return SignalPlans([[(PHASE_CODES["ud"], red_duration), (PHASE_CODES["lr"], HOLD)]
+                        for red_duration in red_durations])
+
+
+class SignalController:
+    """
+    Traffic lights of an array of intersections (e.g. shape (num_intersections,), or (num_copies, num_intersections)
+    for copies of a road network), all dynamic state is kept in a single structured buffer (see: state_dtype):
+
+    - phase - current phase code (NO_PHASE before the first action),
+    - updates_until_state_change - updates left in the current stage (0 for held stages, -1 before the first action),
+    - plan, stage - current plan (action) and its stage.
+    """
+
+    def __init__(self, plans: SignalPlans, shape):
+        self.plans = plans
+        self.shape = tuple(np.atleast_1d(shape))
+        self.size = int(np.prod(self.shape))
+
+        self.state_dtype = np.dtype([(name, np.int64, self.shape)
+                                     for name in ("phase", "updates_until_state_change", "plan", "stage")])
+        self.state = np.zeros((), dtype=self.state_dtype)
+        self.phase = self.state["phase"]
+        self.updates_until_state_change = self.state["updates_until_state_change"]
+        self.plan = self.state["plan"]
+        self.stage = self.state["stage"]
+        self.phase[...] = NO_PHASE
+        self.updates_until_state_change[...] = -1
+        self.plan[...] = -1
+
+        # flat views of the state (reshape of a contiguous field is a view)
+        self._phase = self.phase.reshape(-1)
+        self._countdown = self.updates_until_state_change.reshape(-1)
+        self._plan = self.plan.reshape(-1)
+        self._stage = self.stage.reshape(-1)
+
+    def get_state(self, state: np.ndarray) -> None:
+        state[...] = self.state
+
+    def set_state(self, state: np.ndarray) -> None:
+        self.state[...] = state
+
+    def set_actions(self, actions: np.ndarray) -> None:
+        """
+        Starts the first stage of the plan selected by every action.
+
+        :param actions: Plan of every intersection (same shape as the controller).
+        """
+        self._plan[:] = np.reshape(actions, -1)
+        self._enter_stage(np.arange(self.size), np.zeros(self.size, dtype=np.int64))
+
+    def _enter_stage(self, idx: np.ndarray, stage: np.ndarray) -> None:
+        """
+        Starts given stages of intersections idx, skipping stages that last 0 updates.
+        """
+        plan = self._plan[idx]
+        num_stages = self.plans.num_stages[plan]
+        updates = self.plans.stage_updates[plan, stage]
+        for _ in range(self.plans.max_stages):
+            skip = updates == 0
+            if not skip.any():
+                break
+            stage = np.where(skip, (stage + 1) % num_stages, stage)
+            updates = self.plans.stage_updates[plan, stage]
+        self._stage[idx] = stage
+        self._phase[idx] = self.plans.stage_phase[plan, stage]
+        self._countdown[idx] = np.maximum(updates, 0)
+
+    def advance(self, num_updates: int = 1, out: np.ndarray = None) -> None:
+        """
+        Advances all traffic lights by num_updates updates (at once, between actions lights do not depend on the
+        simulation), a stage is switched after the update that ends it. Only intersections whose stage ends are
+        touched after the first countdown of all.
+
+        :param out: Array of shape (num_updates, *shape) the phase during every update is written into
+                    (see: engines' run).
+        """
+        countdown = self._countdown
+        if out is not None:
+            out = out.reshape(num_updates, -1)
+            out[:] = self._phase
+
+        # held stages (and lights without action) have countdown 0 (-1)
+        timed = countdown > 0
+        ended = np.flatnonzero(timed & (countdown <= num_updates))
+        countdown -= num_updates * timed
+        # update after which the stage of every ended intersection ended
+        elapsed = countdown[ended] + num_updates
+
+        while ended.size:
+            self._enter_stage(ended, (self._stage[ended] + 1) % self.plans.num_stages[self._plan[ended]])
+            if out is not None:
+                started = np.arange(num_updates).reshape(-1, 1) >= elapsed
+                out[:, ended] = np.where(started, self._phase[ended], out[:, ended])
+
+            remaining = num_updates - elapsed
+            stage_countdown = countdown[ended]
+            timed = stage_countdown > 0
+            again = timed & (stage_countdown <= remaining)
+            countdown[ended] = stage_countdown - remaining * timed
+            elapsed = (elapsed + stage_countdown)[again]
+            ended = ended[again]
@@ -0,0 +1,193 @@
+"""
+Streaming telemetry of GraphTrafficEnv (see: TELEMETRY in params.py): constant-memory aggregates of every update,
+per segment and per intersection, flushed periodically to disk.
+
+Every flush appends one record with the aggregates of the window since the previous flush (the aggregates are then
+cleared) to telemetry.npy in the telemetry directory. Records have a fixed size (see: record_dtype) and the header
+of the file is rewritten with the number of records on every flush, so the file can be read (np.load(...,
+mmap_mode="r")) while an evaluation is running.
+
+Aggregates of a window:
+
+- per segment: running mean and variance of the number of cars, of the mean velocity of its cars (updates with
+  cars only), of its flow (cars leaving the segment per update) and of its queue (stopped cars), histograms of
+  velocities of its cars and of its queue length,
+- per intersection: throughput (cars that crossed it) with running mean and variance per update, running mean and
+  variance of the queue at red lights (stopped cars on entrances with red light).
+"""
+import os
+
+import numpy as np
+
+from gym_graph_traffic.envs.npy_format import npy_header_size, write_npy_header
+
+# queue length histogram: bins 0, 1, ..., QUEUE_BINS - 1 (the last one counts also longer queues)
+QUEUE_BINS = 32
+
+STATISTICS = ("num_cars", "velocity", "flow", "queue")
+INTERSECTION_STATISTICS = ("throughput", "red_queue")
+
+
+def record_dtype(num_segments: int, num_intersections: int, max_v: int) -> np.dtype:
+    fields = [("steps", np.int64), ("updates", np.int64)]
+    for name in STATISTICS:
+        fields += [(f"{name}_mean", np.float32, (num_segments,)), (f"{name}_var", np.float32, (num_segments,))]
+    fields += [("velocity_histogram", np.uint32, (num_segments, max_v + 1)),
+               ("queue_histogram", np.uint32, (num_segments, QUEUE_BINS)),
+               ("throughput", np.uint32, (num_intersections,))]
+    for name in INTERSECTION_STATISTICS:
+        fields += [(f"{name}_mean", np.float32, (num_intersections,)),
+                   (f"{name}_var", np.float32, (num_intersections,))]
+    return np.dtype(fields)
+
+
+class RunningStats:
+    """
+    Running mean and variance of an array of quantities (Welford's algorithm), one observation of every element
+    per update.
+    """
+
+    def __init__(self, size: int):
+        self.count = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size, dtype=np.float64)
+        self.m2 = np.zeros(size, dtype=np.float64)
+        self._delta = np.zeros(size, dtype=np.float64)
+
+    def reset(self) -> None:
+        self.count[:] = 0
+        self.mean[:] = 0
+        self.m2[:] = 0
+
+    def update(self, x: np.ndarray, mask: np.ndarray = None) -> None:
+        """
+        :param mask: Elements that are observed (all if not given).
+        """
+        if mask is None:
+            self.count += 1
+            np.subtract(x, self.mean, out=self._delta)
+            self.mean += self._delta / self.count
+            self.m2 += self._delta * (x - self.mean)
+        else:
+            self.count += mask
+            np.subtract(x, self.mean, out=self._delta, where=mask)
+            self.mean += np.divide(self._delta, self.count, out=np.zeros_like(self._delta), where=mask)
+            self.m2 += np.where(mask, self._delta * (x - self.mean), 0)
+
+    def variance(self) -> np.ndarray:
+        """
+        :return: Population variance (0 for elements without observations).
+        """
+        return np.divide(self.m2, self.count, out=np.zeros_like(self.m2), where=self.count > 0)
+
+
+class Telemetry:
+    """
+    Aggregates every update of an environment (see: update) and writes them to directory every flush_every steps.
+    """
+
+    def __init__(self, directory: str, env, flush_every: int = 200):
+        self.directory = directory
+        self.env = env
+        self.engine = env.engine
+        self.graph = env.road_graph
+        self.flush_every = flush_every
+        os.makedirs(directory, exist_ok=True)
+
+        num_segments = self.graph.num_segments
+        num_intersections = self.graph.num_intersections
+        self.max_v = self.engine.max_v
+        self.dtype = record_dtype(num_segments, num_intersections, self.max_v)
+
+        # aggregates of the current window (steps are counted since the start, over all episodes)
+        self.steps = 0
+        self.updates = 0
+        self.stats = {name: RunningStats(num_segments) for name in STATISTICS}
+        self.intersection_stats = {name: RunningStats(num_intersections) for name in INTERSECTION_STATISTICS}
+        self.velocity_histogram = np.zeros((num_segments, self.max_v + 1), dtype=np.int64)
+        self.queue_histogram = np.zeros((num_segments, QUEUE_BINS), dtype=np.int64)
+        self.throughput = np.zeros(num_intersections, dtype=np.int64)
+
+        # cell -> segment, and preallocated buffers of an update
+        self._segment_of_cell = np.repeat(np.arange(num_segments), self.graph.lengths)
+        self._mean_velocity = np.zeros(num_segments, dtype=np.float64)
+        self._queue = np.zeros(num_segments, dtype=np.int64)
+
+        # records are appended to the file, its header has a fixed size (room for any number of records)
+        self.path = os.path.join(directory, "telemetry.npy")
+        self.num_records = 0
+        self._header_size = npy_header_size(self.dtype, 1)
+        self._file = open(self.path, "wb")
+        write_npy_header(self._file, self.dtype, (0,), self._header_size)
+
+    def update(self) -> None:
+        """
+        Adds state after the last update of the engine to the aggregates.
+        """
+        self.updates += 1
+        num_cars = self.engine.num_cars[0]
+        crossed = self.engine.crossed[0]
+        occupied = np.flatnonzero(self.engine.occupancy()[0])
+        velocity = self.engine.velocity()[0, occupied]
+        car_segment = self._segment_of_cell[occupied]
+
+        # segments
+        has_cars = num_cars > 0
+        np.divide(self.engine.total_distance[0], num_cars, out=self._mean_velocity, where=has_cars)
+        self._queue[:] = np.bincount(car_segment[velocity == 0], minlength=self._queue.size)
+        self.stats["num_cars"].update(num_cars)
+        self.stats["velocity"].update(self._mean_velocity, has_cars)
+        self.stats["flow"].update(crossed)
+        self.stats["queue"].update(self._queue)
+        self.velocity_histogram.reshape(-1)[:] += np.bincount(car_segment * (self.max_v + 1) + velocity,
+                                                              minlength=self.velocity_histogram.size)
+        self.queue_histogram[np.arange(self._queue.size), np.minimum(self._queue, QUEUE_BINS - 1)] += 1
+
+        # intersections (entrances with red light, see: RoadGraph.green)
+        red = ~self.graph.green(self.env.signals.phase) & self.graph.has_next_segment
+        num_intersections = self.throughput.size
+        throughput = np.bincount(self.graph.to_intersection, weights=crossed, minlength=num_intersections)
+        red_queue = np.bincount(self.graph.to_intersection, weights=self._queue * red, minlength=num_intersections)
+        self.throughput += throughput.astype(np.int64)
+        self.intersection_stats["throughput"].update(throughput)
+        self.intersection_stats["red_queue"].update(red_queue)
+
+    def end_step(self) -> None:
+        self.steps += 1
+        if self.steps % self.flush_every == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Appends the aggregates of the current window to the file and clears them.
+        """
+        if self.updates == 0:
+            return
+        record = np.zeros((), dtype=self.dtype)
+        record["steps"] = self.steps
+        record["updates"] = self.updates
+        for name, stats in self.stats.items():
+            record[f"{name}_mean"] = stats.mean
+            record[f"{name}_var"] = stats.variance()
+            stats.reset()
+        for name, stats in self.intersection_stats.items():
+            record[f"{name}_mean"] = stats.mean
+            record[f"{name}_var"] = stats.variance()
+            stats.reset()
+        record["velocity_histogram"] = self.velocity_histogram
+        record["queue_histogram"] = self.queue_histogram
+        record["throughput"] = self.throughput
+        self.velocity_histogram[:] = 0
+        self.queue_histogram[:] = 0
+        self.throughput[:] = 0
+        self.updates = 0
+
+        self._file.write(record.tobytes())
+        self.num_records += 1
+        write_npy_header(self._file, self.dtype, (self.num_records,), self._header_size)
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
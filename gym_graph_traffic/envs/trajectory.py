@@ -0,0 +1,161 @@
+"""
+Recording of full cell-level trajectories of episodes, and their replay.
+
+Every episode is stored in a directory as two files:
+
+- episode_<n>.npy - one record per update (the first one after reset): occupancy of all cells packed as bits,
+  velocity of every cell (uint8), traffic light phase code, updates until state change, plan and its stage of every
+  intersection (see: signals.SignalController).
+  The file is preallocated for the whole episode and filled in through a memory map, record by record.
+- episode_<n>.index.npz - index written at the end of the episode: number of records, record at the beginning of
+  every step and actions of every step.
+
+Trajectory memory-maps the records, so any state can be read (or loaded into an environment) without re-simulating.
+"""
+import os
+
+import numpy as np
+
+
+def record_dtype(num_cells: int, num_intersections: int) -> np.dtype:
+    return np.dtype([("occupancy", np.uint8, ((num_cells + 7) // 8,)),
+                     ("velocity", np.uint8, (num_cells,)),
+                     ("phase", np.uint8, (num_intersections,)),
+                     ("updates_until_state_change", np.int32, (num_intersections,)),
+                     ("plan", np.int16, (num_intersections,)),
+                     ("stage", np.uint8, (num_intersections,))])
+
+
+def episode_paths(directory: str, episode: int):
+    """
+    :return: Paths of the records and the index of the episode.
+    """
+    name = os.path.join(directory, f"episode_{episode:06d}")
+    return f"{name}.npy", f"{name}.index.npz"
+
+
+class TrajectoryRecorder:
+    """
+    Records every update of GraphTrafficEnv (see: RECORD_TRAJECTORY in params.py), one episode per reset.
+    """
+
+    def __init__(self, directory: str, env):
+        self.directory = directory
+        self.env = env
+        os.makedirs(directory, exist_ok=True)
+
+        self.dtype = record_dtype(env.road_graph.num_cells, env.num_intersections)
+        self.capacity = env.steps_per_episode * env.updates_per_step + 1
+
+        self.episode = -1
+        self.records = None
+        self.num_records = 0
+        self.steps = []
+        self.actions = []
+
+    def start_episode(self) -> None:
+        """
+        Finishes the current episode and records the initial state of a new one.
+        """
+        self.finish_episode()
+        self.episode += 1
+        records_path, _ = episode_paths(self.directory, self.episode)
+        self.records = np.lib.format.open_memmap(records_path, mode="w+", dtype=self.dtype, shape=(self.capacity,))
+        self.num_records = 0
+        self.steps = []
+        self.actions = []
+        self.record()
+
+    def start_step(self, action_array) -> None:
+        """
+        Starts recording of a step (and of an episode beginning in the current state, if the environment was
+        stepped without a reset).
+        """
+        if self.records is None:
+            self.start_episode()
+        self.steps.append(self.num_records - 1)
+        self.actions.append(action_array)
+
+    def record(self) -> None:
+        """
+        Records the current state of the environment.
+        """
+        if self.num_records == self.capacity:
+            raise ValueError(f"Episode is longer than {self.env.steps_per_episode} steps, reset the environment")
+        record = self.records[self.num_records]
+        record["occupancy"] = np.packbits(self.env.engine.occupancy()[0])
+        record["velocity"] = self.env.engine.velocity()[0]
+        signals = self.env.signals
+        record["phase"] = signals.phase
+        record["updates_until_state_change"] = signals.updates_until_state_change
+        record["plan"] = signals.plan
+        record["stage"] = signals.stage
+        self.num_records += 1
+
+    def finish_episode(self) -> None:
+        if self.records is None:
+            return
+        self.records.flush()
+        self.records = None
+        _, index_path = episode_paths(self.directory, self.episode)
+        np.savez(index_path,
+                 num_records=self.num_records,
+                 steps=np.array(self.steps, dtype=np.int64),
+                 actions=np.array(self.actions, dtype=np.int64).reshape(len(self.actions), self.env.num_intersections))
+
+    def close(self) -> None:
+        self.finish_episode()
+
+
+class Trajectory:
+    """
+    Recorded episode (see: TrajectoryRecorder). Records are memory-mapped, so reading a state costs only the pages
+    it occupies.
+    """
+
+    def __init__(self, directory: str, episode: int = 0):
+        records_path, index_path = episode_paths(directory, episode)
+        with np.load(index_path) as index:
+            self.num_records = int(index["num_records"])
+            self.steps = index["steps"]
+            self.actions = index["actions"]
+        self.records = np.load(records_path, mmap_mode="r")[:self.num_records]
+        self.num_steps = len(self.steps)
+        self.num_cells = self.records.dtype["velocity"].shape[0]
+
+    def record_index(self, step: int, update: int = 0) -> int:
+        """
+        :return: Index of the record of the state before given update of the step (update 0: before the actions
+                 of the step were applied; step num_steps: final state of the episode).
+        """
+        if step == self.num_steps:
+            return self.num_records - 1
+        return int(self.steps[step]) + update
+
+    def state(self, record: int) -> dict:
+        """
+        :return: Unpacked state: occupancy (uint8, 1 if there is a car) and velocity of every cell,
+                 phase code, updates until state change, plan and stage of every intersection.
+        """
+        record = self.records[record]
+        return {"occupancy": np.unpackbits(record["occupancy"], count=self.num_cells),
+                "velocity": np.array(record["velocity"]),
+                "phase": np.array(record["phase"]),
+                "updates_until_state_change": np.array(record["updates_until_state_change"]),
+                "plan": np.array(record["plan"]),
+                "stage": np.array(record["stage"])}
+
+    def restore(self, env, step: int, update: int = 0) -> None:
+        """
+        Loads the state of the environment before given update of the step, without re-simulating.
+        Random number generator and queues of an open boundary are not part of the trajectory: simulation continues
+        with env's own stream and empty queues.
+        """
+        state = self.state(self.record_index(step, update))
+        env.engine.load_cells(state["occupancy"], state["velocity"])
+        if env.engine.boundary is not None:
+            env.engine.boundary.reset(step * env.updates_per_step + update)
+        for name in ("phase", "updates_until_state_change", "plan", "stage"):
+            getattr(env.signals, name)[:] = state[name]
+        env.current_step = step
+        env.reward_observation.reset()
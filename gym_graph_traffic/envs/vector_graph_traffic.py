@@ -0,0 +1,143 @@
+from typing import Dict, List
+
+import gym
+import numpy as np
+from attrdict import AttrDict
+
+from gym_graph_traffic.envs.actions import ActionDecoder
+from gym_graph_traffic.envs.engine import VectorizedEngine
+from gym_graph_traffic.envs.graph_traffic import RewardObservationWrapper, seed_rng
+from gym_graph_traffic.envs.road_graph import RoadGraph
+from gym_graph_traffic.envs.signals import SignalController, red_duration_plans
+
+
+# info fields of a step (see: RewardObservationWrapper.info), sent as arrays by environments in other processes
+INFO_FIELDS = ("mean_speed", "mean_n_cars")
+
+
+def env_seeds(seed, num_envs: int) -> list:
+    """
+    :param seed: Seed of the first environment, a list of seeds of all environments, or None (random seed).
+    :return: Seed of every environment of a vector env: seed + index (or consecutive elements of a list of seeds).
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy % (2 ** 31)
+    return list(seed) if isinstance(seed, (list, tuple)) else [seed + i for i in range(num_envs)]
+
+
+def step_infos(action_decoder: ActionDecoder, red_durations_raw: np.ndarray, actions: np.ndarray,
+               fields: Dict[str, np.ndarray], dones: np.ndarray, terminal_observations: np.ndarray) -> List[dict]:
+    """
+    :param actions: Actions of all environments of a vector env.
+    :param fields: Info fields (e.g. mean_speed): name -> value of every environment.
+    :param terminal_observations: Last observations of environments that finished their episodes (see: dones).
+    :return: Info dict of every environment after a step.
+    """
+    action_arrays = action_decoder.decode(actions)
+    infos = [{**({"action_int": action} if action_decoder.action_mode == "discrete" else {}),
+              "action_array": list(red_durations_raw[action_array]),
+              **{key: value[i] for key, value in fields.items()}}
+             for i, (action, action_array) in enumerate(zip(actions, action_arrays))]
+    for i in np.flatnonzero(dones):
+        infos[i]["terminal_observation"] = terminal_observations[i]
+    return infos
+
+
+class VectorGraphTrafficEnv(gym.vector.VectorEnv):
+    """
+    num_envs independent copies of the same road network, simulated together by a single VectorizedEngine:
+    every update advances all copies at once. Compatible with gym's VectorEnv API (observations, rewards and dones
+    are stacked along the first axis, copies are reset automatically at the end of an episode).
+    """
+
+    def __init__(self, params, num_envs: int):
+
+        params = AttrDict(params)
+        self.params = params
+
+        # simulation params
+        self.updates_per_step = params.updates_per_step
+        self.steps_per_episode = params.steps_per_episode
+        self.fast_forward = params.get("fast_forward", False)
+        self.red_durations = np.array(params.red_durations)
+        self.red_durations_raw = np.array(params.red_durations_raw)
+        self.num_red_durations = len(params.red_durations)
+
+        # random number generator of all copies
+        self.np_random = np.random.default_rng(params.get("seed"))
+
+        # road graph (shared by all copies) and engine
+        self.num_intersections = len(params.intersections)
+        self.num_segments = len(params.segments)
+        self.road_graph = RoadGraph.from_params(params)
+        self.engine = VectorizedEngine(self.road_graph, None, None, params, self.np_random, num_copies=num_envs)
+
+        # traffic lights of all copies (see: signals.SignalController)
+        self.signals = SignalController(red_duration_plans(params.red_durations), (num_envs, self.num_intersections))
+        self._phases = np.zeros((self.updates_per_step, num_envs, self.num_intersections), dtype=np.int64)
+        self.action_decoder = ActionDecoder(params.get("action_mode", "discrete"), self.num_red_durations,
+                                            self.num_intersections)
+
+        # current simulation status
+        self.current_step = 0
+        self.reward_observation = RewardObservationWrapper(self.engine)
+
+        # gym-specific attributes
+        super().__init__(num_envs,
+                         self.reward_observation.observation_space,
+                         self.action_decoder.space)
+        self.reward_range = self.reward_observation.reward_range
+        self._actions = None
+
+    def seed(self, seed=None):
+        return [seed_rng(self.np_random, seed)]
+
+    def reset_async(self, *args, **kwargs):
+        pass
+
+    def reset_wait(self, seed=None, **kwargs):
+        if seed is not None:
+            self.seed(seed)
+
+        self.engine.reset()
+
+        self.current_step = 0
+
+        return self.reward_observation.reset()
+
+    def step_async(self, actions):
+        self._actions = actions
+
+    def step_wait(self):
+
+        # apply actions into intersections of all copies
+        action_arrays = self.action_decoder.decode(self._actions)
+        self.signals.set_actions(action_arrays)
+
+        self.reward_observation.reset()
+
+        if self.fast_forward:
+            self.signals.advance(self.updates_per_step, out=self._phases)
+            self.engine.run(self._phases, self.reward_observation)
+        else:
+            for update in range(self.updates_per_step):
+                self.engine.update(self.signals.phase)
+                self.signals.advance()
+                self.reward_observation.update()
+
+        self.current_step += 1
+        done = self.current_step >= self.steps_per_episode
+        dones = np.full(self.num_envs, done)
+
+        rewards, observations = self.reward_observation.values()
+        infos = step_infos(self.action_decoder, self.red_durations_raw, self._actions,
+                           self.reward_observation.info(), dones, observations)
+
+        # all copies finish their episodes at the same time
+        if done:
+            observations = self.reset_wait()
+
+        return observations, rewards, dones, infos
+
+    def close_extras(self, **kwargs):
+        self.engine.close()
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from gym_graph_traffic.envs import GraphTrafficEnv
+from gym_graph_traffic.envs.kernels import NUMBA_AVAILABLE
+from gym_graph_traffic.envs.params import PARAMETERS, PRESETS
+
+NUM_STEPS = 20
+
+requires_numba = pytest.mark.skipif(not NUMBA_AVAILABLE, reason="numba is not installed")
+
+
+def make_env(preset, **params):
+    return GraphTrafficEnv({**PARAMETERS, **PRESETS[preset], "seed": 0, **params})
+
+
+def run(kernel_backend, preset, fast_forward):
+    """
+    :return: Rewards, occupancy and velocity of every step of an episode with the given kernel backend.
+    """
+    env = make_env(preset, engine="vectorized", kernel_backend=kernel_backend, fast_forward=fast_forward)
+    env.reset()
+    actions = np.random.default_rng(1)
+    rewards, occupancy, velocity = [], [], []
+    for _ in range(NUM_STEPS):
+        _, reward, done, _ = env.step(actions.integers(env.action_space.n))
+        rewards.append(reward)
+        occupancy.append(env.engine.occupancy().copy())
+        velocity.append(env.engine.velocity().copy())
+        if done:
+            env.reset()
+    env.close()
+    return rewards, occupancy, velocity
+
+
+@requires_numba
+@pytest.mark.parametrize("preset", ["easy", "grid_3x3"])
+@pytest.mark.parametrize("fast_forward", [False, True])
+def test_numba_and_numpy_backends_are_identical(preset, fast_forward):
+    numpy_rewards, numpy_occupancy, numpy_velocity = run("numpy", preset, fast_forward)
+    numba_rewards, numba_occupancy, numba_velocity = run("numba", preset, fast_forward)
+    np.testing.assert_array_equal(numba_rewards, numpy_rewards)
+    np.testing.assert_array_equal(numba_occupancy, numpy_occupancy)
+    np.testing.assert_array_equal(numba_velocity, numpy_velocity)
+
+
+def episode(preset, **params):
+    """
+    :return: Observations and rewards of every step of an episode (same actions for every configuration).
+    """
+    env = make_env(preset, **params)
+    observations, rewards = [env.reset()], []
+    actions = np.random.default_rng(1)
+    for _ in range(NUM_STEPS):
+        observation, reward, done, _ = env.step(actions.integers(env.action_space.n))
+        observations.append(observation)
+        rewards.append(reward)
+        if done:
+            observations.append(env.reset())
+    env.close()
+    return observations, rewards
+
+
+@pytest.mark.parametrize("preset", ["easy", "grid_3x3"])
+@pytest.mark.parametrize("engine, partitions", [
+    ("segments", 1),
+    ("vectorized", 1),
+    pytest.param("vectorized", 4, marks=requires_numba),
+])
+@pytest.mark.parametrize("routes", [None, "turns", "od"])
+@pytest.mark.parametrize("open_boundary", [False, True])
+@pytest.mark.parametrize("fast_forward", [False, True])
+def test_configurations_follow_the_reference_engine(preset, engine, partitions, routes, open_boundary, fast_forward):
+    """
+    Every engine, partitioning and stepping mode gives the trajectory of the segments engine stepped update by update.
+    """
+    reference_observations, reference_rewards = episode(preset, engine="segments", routes=routes,
+                                                        open_boundary=open_boundary)
+    observations, rewards = episode(preset, engine=engine, kernel_backend="numba" if partitions > 1 else "auto",
+                                    partitions=partitions, routes=routes, open_boundary=open_boundary,
+                                    fast_forward=fast_forward)
+    np.testing.assert_array_equal(rewards, reference_rewards)
+    np.testing.assert_array_equal(observations, reference_observations)
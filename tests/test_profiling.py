@@ -0,0 +1,29 @@
+import pytest
+
+from gym_graph_traffic.envs import GraphTrafficEnv
+from gym_graph_traffic.envs.kernels import NUMBA_AVAILABLE
+from gym_graph_traffic.envs.params import PARAMETERS, PRESETS
+
+NUM_STEPS = 2
+
+
+@pytest.mark.parametrize("engine, kernel_backend, extra", [
+    ("segments", "numpy", {}),
+    ("vectorized", "numpy", {}),
+    pytest.param("vectorized", "numba", {}, marks=pytest.mark.skipif(not NUMBA_AVAILABLE, reason="requires numba")),
+    pytest.param("vectorized", "numba", {"partitions": 4},
+                 marks=pytest.mark.skipif(not NUMBA_AVAILABLE, reason="requires numba")),
+    pytest.param("vectorized", "numba", {"routes": "turns"},
+                 marks=pytest.mark.skipif(not NUMBA_AVAILABLE, reason="requires numba")),
+    pytest.param("vectorized", "numba", {"open_boundary": True},
+                 marks=pytest.mark.skipif(not NUMBA_AVAILABLE, reason="requires numba")),
+])
+@pytest.mark.parametrize("fast_forward", [False, True])
+def test_updates_are_counted_once(engine, kernel_backend, extra, fast_forward):
+    env = GraphTrafficEnv({**PARAMETERS, **PRESETS["grid_3x3"], "engine": engine, "kernel_backend": kernel_backend,
+                           "fast_forward": fast_forward, "profile": True, "seed": 0, **extra})
+    env.reset()
+    for _ in range(NUM_STEPS):
+        env.step(1)
+    assert env.stats()["counters"]["updates"] == NUM_STEPS * env.updates_per_step
+    env.close()
@@ -0,0 +1,27 @@
+import numpy as np
+
+from gym_graph_traffic.envs import GraphTrafficEnv
+from gym_graph_traffic.envs.params import PARAMETERS, PRESETS
+
+
+def make_env(**params):
+    return GraphTrafficEnv({**PARAMETERS, **PRESETS["grid_3x3"], "seed": 0, **params})
+
+
+def test_render_after_reset():
+    env = make_env()
+    env.reset()
+    frame = env.render("rgb_array")
+    width, height = env.params.render_screen_size
+    scale = env.params.render_scale_factor
+    assert frame.shape == (height * scale, width * scale, 3)
+    assert frame.dtype == np.uint8
+    env.close()
+
+
+def test_render_after_step():
+    env = make_env()
+    env.reset()
+    env.step(env.action_space.sample())
+    assert env.render("rgb_array").any()
+    env.close()
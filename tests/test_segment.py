@@ -0,0 +1,26 @@
+import numpy as np
+
+from gym_graph_traffic.envs.segment import Segment
+
+
+def make_segment(length=10, max_v=5):
+    return Segment(0, length, None, "l", car_density=0, max_v=max_v, prob_slow_down=0,
+                   intersection_size=2, rng=np.random.default_rng(0))
+
+
+def test_receive_cars_moves_cars_from_start():
+    segment = make_segment()
+    segment.set_cells(np.array([0, 0, 0, 0, 0, 0, 0, 1, 1, 1]), np.array([0, 0, 0, 0, 0, 0, 0, 1, 2, 3]))
+
+    # cars of the segment near the beginning of the buffers (0 < start < number of received cars)
+    start = 1
+    segment._x[start:start + 3] = segment._x[-3:]
+    segment._v[start:start + 3] = segment._v[-3:]
+    segment._start = start
+
+    segment.receive_cars(np.array([0, 1]), np.array([4, 5]))
+
+    assert segment.num_cars() == 5
+    np.testing.assert_array_equal(segment._x[segment._start:segment._start + 5], [0, 1, 7, 8, 9])
+    np.testing.assert_array_equal(segment.v, [4, 5, 1, 2, 3])
+    np.testing.assert_array_equal(np.flatnonzero(segment.p), [0, 1, 7, 8, 9])
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from gym_graph_traffic.envs import GraphTrafficEnv
+from gym_graph_traffic.envs.params import PARAMETERS, PRESETS
+
+NUM_STEPS = 5
+
+
+def continue_episode(env, actions):
+    return [env.step(action)[:2] for action in actions]
+
+
+@pytest.mark.parametrize("engine", ["segments", "vectorized"])
+@pytest.mark.parametrize("extra", [{}, {"routes": "od"}, {"open_boundary": True}])
+def test_set_state_restores_get_state(engine, extra):
+    env = GraphTrafficEnv({**PARAMETERS, **PRESETS["grid_3x3"], "engine": engine, "seed": 0, **extra})
+    env.reset()
+    actions = np.random.default_rng(1).integers(env.action_space.n, size=2 * NUM_STEPS)
+    continue_episode(env, actions[:NUM_STEPS])
+
+    state = env.get_state()
+    expected = continue_episode(env, actions[NUM_STEPS:])
+
+    # restored from the array and from its raw bytes, into the same environment and into a fresh one
+    fresh_env = GraphTrafficEnv({**PARAMETERS, **PRESETS["grid_3x3"], "engine": engine, "seed": 1, **extra})
+    for target, snapshot in [(env, state), (fresh_env, state.tobytes())]:
+        target.set_state(snapshot)
+        assert target.get_state().tobytes() == state.tobytes()
+        for (observation, reward), (expected_observation, expected_reward) in zip(
+                continue_episode(target, actions[NUM_STEPS:]), expected):
+            np.testing.assert_array_equal(observation, expected_observation)
+            assert reward == expected_reward
+    env.close()
+    fresh_env.close()
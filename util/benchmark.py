@@ -0,0 +1,210 @@
+"""
+Throughput and memory benchmark of GraphTrafficEnv.
+
+Runs every preset from params.py and synthetic make_grid networks (2x2 up to 32x32 by default) and reports
+updates/sec, steps/sec, time per update of every phase (first and second phase of the segments update,
+intersections update, reward computation), peak memory and memory of an environment per cell of the network as JSON:
+
+    python -m util.benchmark --engine vectorized --output benchmark.json
+    python -m util.benchmark --memory-only --presets --grid-sizes 32 64 100
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from gym_graph_traffic.envs import GraphTrafficEnv
+from gym_graph_traffic.envs.kernels import NUMBA_AVAILABLE
+from gym_graph_traffic.envs.params import PARAMETERS, PRESETS, SEGMENT_LENGTH
+from util import grid
+
+PHASES = ("update_first_phase", "update_second_phase", "intersections_update", "reward_update")
+GRID_SIZES = (2, 4, 8, 16, 32)
+
+
+def networks(presets=tuple(PRESETS), grid_sizes=GRID_SIZES, segment_len=SEGMENT_LENGTH) -> dict:
+    """
+    :return: Road networks to benchmark: name -> params of the network.
+    """
+    result = {name: PRESETS[name] for name in presets}
+    for size in grid_sizes:
+        result[f"grid_{size}x{size}"] = grid.make_grid(size, size, 1, segment_len=segment_len)
+    return result
+
+
+def _timed_steps(env, actions) -> dict:
+    """
+    Same work as env.step, with every phase of an update timed separately.
+
+    :return: Total time of every phase (in seconds).
+    """
+    timers = dict.fromkeys(PHASES, 0.0)
+    engine = env.engine
+    for action in actions:
+        env.signals.set_actions(env.action_decoder.decode(action))
+        env.reward_observation.reset()
+
+        for update in range(env.updates_per_step):
+            t0 = time.perf_counter()
+            engine.update_first_phase(env.signals.phase)
+            t1 = time.perf_counter()
+            engine.update_second_phase()
+            t2 = time.perf_counter()
+            env.signals.advance()
+            t3 = time.perf_counter()
+            env.reward_observation.update()
+            t4 = time.perf_counter()
+
+            timers["update_first_phase"] += t1 - t0
+            timers["update_second_phase"] += t2 - t1
+            timers["intersections_update"] += t3 - t2
+            timers["reward_update"] += t4 - t3
+    return timers
+
+
+def _params(network: dict, engine: str, kernel_backend: str, seed: int) -> dict:
+    return {**PARAMETERS, **network,
+            "engine": engine,
+            "kernel_backend": kernel_backend,
+            "action_mode": "multi_discrete",  # Discrete space does not fit large grids
+            "seed": seed,
+            "render": False}
+
+
+def _warm_up(params: dict) -> None:
+    """
+    Creates and steps a throwaway environment, so that imports, compilation of kernels and cached road graphs are
+    not included in memory measurements.
+    """
+    env = GraphTrafficEnv(params)
+    env.step(env.action_space.sample())
+    env.close()
+
+
+def memory(network: dict, engine: str, kernel_backend: str, seed: int) -> dict:
+    """
+    Memory held by a single environment after a step, per cell of the network. The compiled road graph and kernels
+    are shared by all environments of a process, so they are built before the measurement.
+
+    :return: Bytes per cell of the environment (memory_bytes_per_cell) and of its snapshot (state_bytes_per_cell).
+    """
+    params = _params(network, engine, kernel_backend, seed)
+    _warm_up(params)
+
+    tracemalloc.start()
+    env = GraphTrafficEnv(params)
+    env.reset()
+    env.step(env.action_space.sample())
+    memory_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    num_cells = env.road_graph.num_cells
+    state_bytes = env.get_state().nbytes
+    env.close()
+    return {"engine": engine,
+            "kernel_backend": getattr(env.engine, "kernel_backend", None),
+            "num_segments": env.num_segments,
+            "num_cells": num_cells,
+            "memory_bytes_per_cell": memory_bytes / num_cells,
+            "state_bytes_per_cell": state_bytes / num_cells}
+
+
+def benchmark(network_name: str, network: dict, engine: str, kernel_backend: str, steps: int,
+              warmup_steps: int, seed: int) -> dict:
+    params = _params(network, engine, kernel_backend, seed)
+    rng = np.random.default_rng(seed)
+
+    # peak memory of construction and a single step (once kernels are compiled, see: memory)
+    _warm_up(params)
+    tracemalloc.start()
+    env = GraphTrafficEnv(params)
+    env.reset()
+    env.step(env.action_space.sample())
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def random_actions(n):
+        return rng.integers(env.num_red_durations, size=(n, env.num_intersections))
+
+    # warm up (e.g. compilation of kernels)
+    for action in random_actions(warmup_steps):
+        env.step(action)
+
+    # throughput of env.step
+    env.reset()
+    actions = random_actions(steps)
+    start = time.perf_counter()
+    for action in actions:
+        env.step(action)
+    elapsed = time.perf_counter() - start
+
+    # time per update of every phase
+    timers = _timed_steps(env, random_actions(steps))
+    num_updates = steps * env.updates_per_step
+    env.close()
+
+    return {"network": network_name,
+            "engine": engine,
+            "kernel_backend": getattr(env.engine, "kernel_backend", None),
+            "num_intersections": env.num_intersections,
+            "num_segments": env.num_segments,
+            "num_cells": int(np.sum(env.engine.lengths)),
+            "steps": steps,
+            "updates_per_step": env.updates_per_step,
+            "steps_per_sec": steps / elapsed,
+            "updates_per_sec": num_updates / elapsed,
+            "phase_sec_per_update": {phase: total / num_updates for phase, total in timers.items()},
+            "peak_memory_bytes": peak_memory,
+            **{key: value for key, value in memory(network, engine, kernel_backend, seed).items()
+               if key.endswith("_per_cell")}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", nargs="+", default=["segments", "vectorized"], help="engines to benchmark")
+    parser.add_argument("--kernel-backend", default="auto", help="kernels of the vectorized engine")
+    parser.add_argument("--presets", nargs="*", default=list(PRESETS), help="presets from params.py")
+    parser.add_argument("--grid-sizes", nargs="*", type=int, default=list(GRID_SIZES),
+                        help="sizes of synthetic NxN make_grid networks")
+    parser.add_argument("--steps", type=int, default=5, help="measured steps per network")
+    parser.add_argument("--warmup-steps", type=int, default=1, help="steps before measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory-only", action="store_true", help="only memory per cell (no throughput)")
+    parser.add_argument("--output", help="JSON file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for network_name, network in networks(args.presets, args.grid_sizes).items():
+        for engine in args.engine:
+            if args.memory_only:
+                result = {"network": network_name, **memory(network, engine, args.kernel_backend, args.seed)}
+                speed = ""
+            else:
+                result = benchmark(network_name, network, engine, args.kernel_backend, args.steps,
+                                   args.warmup_steps, args.seed)
+                speed = f"{result['updates_per_sec']:10.1f} updates/s {result['steps_per_sec']:8.2f} steps/s "
+            results.append(result)
+            print(f"{network_name:>12} {engine:>10}: {speed}{result['memory_bytes_per_cell']:6.1f} bytes/cell "
+                  f"({result['state_bytes_per_cell']:.2f} in snapshot)", file=sys.stderr)
+
+    report = {"meta": {"timestamp": datetime.now().isoformat(),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "numba": NUMBA_AVAILABLE,
+                       "platform": platform.platform()},
+              "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
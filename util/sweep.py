@@ -0,0 +1,281 @@
+"""
+Parallel sweep of fixed-time traffic light plans over road networks and traffic parameters.
+
+Every configuration of the grid (preset x car_density x prob_slow_down x plan) is evaluated over a number of
+episodes, in which every intersection keeps the red duration of the plan (in seconds, from the RED_DURATIONS table
+in params.py) during the whole episode. Configurations run on a process pool: every worker keeps a single environment
+per road network and only changes its traffic parameters between configurations. Per-episode metrics (reward,
+mean_speed, mean_n_cars) are streamed to a columnar file as they arrive:
+
+    python -m util.sweep --presets easy grid_3x3 --car-density 0.05 0.1 0.2 --prob-slow-down 0.1 0.3 \\
+        --plans 0 20 40 60 0,60,0,60 --episodes 5 --output sweep
+
+The output is a directory with a .npy file per column (valid after every batch, np.load(..., mmap_mode="r") reads it
+while the sweep is running), or a Parquet file (output ending with .parquet, requires pyarrow).
+"""
+import argparse
+import itertools
+import multiprocessing as mp
+import os
+import sys
+import time
+from functools import partial
+from typing import Dict, List, Union
+
+import numpy as np
+
+from gym_graph_traffic.envs import GraphTrafficEnv
+from gym_graph_traffic.envs.npy_format import npy_header_size, write_npy_header
+from gym_graph_traffic.envs.params import (CAR_DENSITY, PARAMETERS, PRESETS, PROB_SLOW_DOWN, RED_DURATIONS,
+                                           STEPS_PER_EPISODE)
+
+AXES = ("preset", "car_density", "prob_slow_down", "plan")
+
+COLUMNS = np.dtype([("config", np.int64),
+                    ("episode", np.int64),
+                    ("seed", np.int64),
+                    ("preset", "U32"),
+                    ("car_density", np.float64),
+                    ("prob_slow_down", np.float64),
+                    ("plan", "U128"),
+                    ("reward", np.float64),
+                    ("mean_speed", np.float64),
+                    ("mean_n_cars", np.float64)])
+
+Plan = Union[int, tuple]
+
+
+def expand_grid(grid: Dict[str, list]) -> List[dict]:
+    """
+    :param grid: Values of every axis (see: AXES), plan is a red duration in seconds of all intersections or a tuple
+                 of red durations of every intersection.
+    :return: All configurations (preset varies slowest, so configurations of the same road network are adjacent).
+    """
+    unknown = set(grid) - set(AXES)
+    if unknown:
+        raise ValueError(f"Unknown axes: {', '.join(sorted(unknown))} (available: {', '.join(AXES)})")
+    values = [grid[axis] for axis in AXES]
+    return [{"index": index, **dict(zip(AXES, config))} for index, config in enumerate(itertools.product(*values))]
+
+
+def plan_name(plan: Plan) -> str:
+    return "-".join(str(red_duration) for red_duration in np.atleast_1d(plan))
+
+
+def plan_action(env, plan: Plan) -> np.ndarray:
+    """
+    :return: multi_discrete action of the plan (index of red duration of every intersection).
+    """
+    red_durations_raw = list(env.red_durations_raw)
+    if np.ndim(plan) == 1 and len(plan) != env.num_intersections:
+        raise ValueError(f"Plan {plan_name(plan)} has {len(plan)} red durations, the road network has "
+                         f"{env.num_intersections} intersections")
+    plan = np.broadcast_to(plan, env.num_intersections)
+    try:
+        return np.array([red_durations_raw.index(red_duration) for red_duration in plan.tolist()], dtype=np.int64)
+    except ValueError:
+        raise ValueError(f"Plan {plan_name(plan)} is not in the table of red durations {red_durations_raw}")
+
+
+# environments of a worker process: road network (preset) -> environment
+_params = None
+_envs = {}
+
+
+def _init_worker(params: dict) -> None:
+    global _params
+    _params = params
+    _envs.clear()
+
+
+def _env(preset: str) -> GraphTrafficEnv:
+    if preset not in _envs:
+        _envs[preset] = GraphTrafficEnv({**PARAMETERS, **PRESETS[preset], "preset_name": preset, **_params,
+                                         "action_mode": "multi_discrete"})
+    return _envs[preset]
+
+
+def run_configuration(episodes: int, seed: int, config: dict) -> np.ndarray:
+    """
+    :return: Rows (of COLUMNS) of every episode of the configuration, episode i is seeded with seed + i
+             (the same for all configurations).
+    """
+    env = _env(config["preset"])
+    env.engine.set_traffic(config["car_density"], config["prob_slow_down"])
+    action = plan_action(env, config["plan"])
+
+    rows = np.zeros(episodes, dtype=COLUMNS)
+    rows["config"] = config["index"]
+    rows["preset"] = config["preset"]
+    rows["car_density"] = config["car_density"]
+    rows["prob_slow_down"] = config["prob_slow_down"]
+    rows["plan"] = plan_name(config["plan"])
+    for episode in range(episodes):
+        env.reset(seed=seed + episode)
+        reward = mean_speed = mean_n_cars = 0.0
+        done = False
+        while not done:
+            _, step_reward, done, info = env.step(action)
+            reward += step_reward
+            mean_speed += info["mean_speed"]
+            mean_n_cars += info["mean_n_cars"]
+        row = rows[episode:episode + 1]
+        row["episode"] = episode
+        row["seed"] = seed + episode
+        row["reward"] = reward
+        row["mean_speed"] = mean_speed / env.current_step
+        row["mean_n_cars"] = mean_n_cars / env.current_step
+    return rows
+
+
+class NpyColumnWriter:
+    """
+    Streams rows into a directory with a .npy file per column. Headers have a fixed size and are rewritten with the
+    number of rows on every flush, so the files are valid after every write.
+    """
+
+    def __init__(self, directory: str, dtype: np.dtype):
+        os.makedirs(directory, exist_ok=True)
+        self.dtype = dtype
+        self.num_rows = 0
+        self._files = {name: open(os.path.join(directory, f"{name}.npy"), "wb") for name in dtype.names}
+        self._header_sizes = {name: npy_header_size(dtype[name], 1) for name in dtype.names}
+        self.flush()
+
+    def write(self, rows: np.ndarray) -> None:
+        for name, file in self._files.items():
+            file.write(np.ascontiguousarray(rows[name]).data)
+        self.num_rows += rows.size
+        self.flush()
+
+    def flush(self) -> None:
+        for name, file in self._files.items():
+            write_npy_header(file, self.dtype[name], (self.num_rows,), self._header_sizes[name])
+            file.flush()
+
+    def close(self) -> None:
+        for file in self._files.values():
+            file.close()
+
+
+class ParquetWriter:
+    """
+    Streams rows into a Parquet file, in row groups of at least row_group_size rows.
+    """
+
+    def __init__(self, path: str, row_group_size: int = 65536):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow), or use a directory output")
+        self._pyarrow = pyarrow
+        self.row_group_size = row_group_size
+        self._rows = []
+        self._num_buffered = 0
+        self._writer = None
+        self._path = path
+        self.num_rows = 0
+
+    def write(self, rows: np.ndarray) -> None:
+        self._rows.append(rows)
+        self._num_buffered += rows.size
+        self.num_rows += rows.size
+        if self._num_buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        rows = np.concatenate(self._rows)
+        table = self._pyarrow.table({name: rows[name] for name in rows.dtype.names})
+        if self._writer is None:
+            self._writer = self._pyarrow.parquet.ParquetWriter(self._path, table.schema)
+        self._writer.write_table(table)
+        self._rows = []
+        self._num_buffered = 0
+
+    def close(self) -> None:
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+def open_writer(path: str, dtype: np.dtype = COLUMNS):
+    if path.endswith(".parquet"):
+        return ParquetWriter(path)
+    return NpyColumnWriter(path, dtype)
+
+
+def sweep(grid: Dict[str, list], output: str, episodes: int = 1, seed: int = 0, params: dict = None,
+          processes: int = None, chunksize: int = None) -> int:
+    """
+    Runs all configurations of the grid (see: expand_grid) and streams their per-episode metrics to output.
+
+    :param params: Parameters of all environments (e.g. engine, fast_forward, steps_per_episode).
+    :param processes: Number of worker processes (default: number of cores; 1: run in this process).
+    :return: Number of rows written.
+    """
+    configs = expand_grid(grid)
+    params = dict(params or {})
+    processes = processes or os.cpu_count()
+    run = partial(run_configuration, episodes, seed)
+
+    writer = open_writer(output)
+    try:
+        if processes == 1:
+            _init_worker(params)
+            for rows in map(run, configs):
+                writer.write(rows)
+        else:
+            # chunks of adjacent configurations mostly share their road network (and so the environment)
+            chunksize = chunksize or max(1, min(64, len(configs) // (4 * processes)))
+            with mp.Pool(processes, initializer=_init_worker, initargs=(params,)) as pool:
+                for rows in pool.imap_unordered(run, configs, chunksize):
+                    writer.write(rows)
+    finally:
+        writer.close()
+    return writer.num_rows
+
+
+def _plan(value: str) -> Plan:
+    """
+    "20" -> 20 (all intersections), "0,20,40" -> (0, 20, 40) (every intersection).
+    """
+    red_durations = tuple(int(red_duration) for red_duration in value.split(","))
+    return red_durations[0] if len(red_durations) == 1 else red_durations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presets", nargs="+", default=[PARAMETERS["preset_name"]], choices=list(PRESETS))
+    parser.add_argument("--car-density", nargs="+", type=float, default=[CAR_DENSITY])
+    parser.add_argument("--prob-slow-down", nargs="+", type=float, default=[PROB_SLOW_DOWN])
+    parser.add_argument("--plans", nargs="+", type=_plan, default=list(RED_DURATIONS),
+                        help="red durations in seconds: one for all intersections, or comma-separated per intersection")
+    parser.add_argument("--episodes", type=int, default=1, help="episodes per configuration")
+    parser.add_argument("--steps-per-episode", type=int, default=STEPS_PER_EPISODE)
+    parser.add_argument("--engine", default="vectorized")
+    parser.add_argument("--no-fast-forward", action="store_true", help="run updates of a step one by one")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: number of cores)")
+    parser.add_argument("--seed", type=int, default=0, help="episode i of every configuration is seeded with seed + i")
+    parser.add_argument("--output", required=True, help="output directory (.npy columns) or .parquet file")
+    args = parser.parse_args(argv)
+
+    grid = {"preset": args.presets,
+            "car_density": args.car_density,
+            "prob_slow_down": args.prob_slow_down,
+            "plan": args.plans}
+    params = {"engine": args.engine,
+              "fast_forward": not args.no_fast_forward,
+              "steps_per_episode": args.steps_per_episode}
+
+    start = time.perf_counter()
+    num_rows = sweep(grid, args.output, args.episodes, args.seed, params, args.processes)
+    elapsed = time.perf_counter() - start
+    print(f"{num_rows} episodes in {elapsed:.1f}s ({num_rows / elapsed:.1f} episodes/s) -> {args.output}",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()